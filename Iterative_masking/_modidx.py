@@ -18,18 +18,36 @@ d = { 'settings': { 'branch': 'main',
                                                                                                          'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.__init__': ( 'core.html#im_msa_transformer.__init__',
                                                                                                 'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.burn_in_step': ( 'core.html#im_msa_transformer.burn_in_step',
+                                                                                                    'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.column_windows': ( 'core.html#im_msa_transformer.column_windows',
+                                                                                                      'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.compute_contacts': ( 'core.html#im_msa_transformer.compute_contacts',
                                                                                                         'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.compute_embeddings': ( 'core.html#im_msa_transformer.compute_embeddings',
                                                                                                           'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.context_index': ( 'core.html#im_msa_transformer.context_index',
+                                                                                                     'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.forward_layers': ( 'core.html#im_msa_transformer.forward_layers',
+                                                                                                      'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.gather_rows': ( 'core.html#im_msa_transformer.gather_rows',
+                                                                                                   'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.generate_MSA': ( 'core.html#im_msa_transformer.generate_msa',
                                                                                                     'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.generate_MSA_context': ( 'core.html#im_msa_transformer.generate_msa_context',
                                                                                                             'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.generate_all_msa': ( 'core.html#im_msa_transformer.generate_all_msa',
                                                                                                         'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.generate_replicas': ( 'core.html#im_msa_transformer.generate_replicas',
+                                                                                                         'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.generate_with_context_msa': ( 'core.html#im_msa_transformer.generate_with_context_msa',
                                                                                                                  'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.mask_schedule': ( 'core.html#im_msa_transformer.mask_schedule',
+                                                                                                     'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.predict_tokens': ( 'core.html#im_msa_transformer.predict_tokens',
+                                                                                                      'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.predict_window': ( 'core.html#im_msa_transformer.predict_window',
+                                                                                                      'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.print_tokens': ( 'core.html#im_msa_transformer.print_tokens',
                                                                                                     'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.read_msa': ( 'core.html#im_msa_transformer.read_msa',
@@ -38,10 +56,164 @@ d = { 'settings': { 'branch': 'main',
                                                                                                      'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.remove_insertions': ( 'core.html#im_msa_transformer.remove_insertions',
                                                                                                          'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.replica_count': ( 'core.html#im_msa_transformer.replica_count',
+                                                                                                     'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.IM_MSA_Transformer.score_sequences': ( 'core.html#im_msa_transformer.score_sequences',
+                                                                                                       'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.softmax_tensor': ( 'core.html#im_msa_transformer.softmax_tensor',
                                                                                                       'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.tokenize_msa': ( 'core.html#im_msa_transformer.tokenize_msa',
                                                                                                     'Iterative_masking/core.py'),
                                         'Iterative_masking.core.IM_MSA_Transformer.untokenize_msa': ( 'core.html#im_msa_transformer.untokenize_msa',
                                                                                                       'Iterative_masking/core.py'),
-                                        'Iterative_masking.core.gen_MSAs': ('core.html#gen_msas', 'Iterative_masking/core.py')}}}
+                                        'Iterative_masking.core._rss': ('core.html#_rss', 'Iterative_masking/core.py'),
+                                        'Iterative_masking.core._site_frequencies': ( 'core.html#_site_frequencies',
+                                                                                      'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.benchmark_burn_in': ( 'core.html#benchmark_burn_in',
+                                                                                      'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.benchmark_mask_schedule': ( 'core.html#benchmark_mask_schedule',
+                                                                                            'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.benchmark_scoring': ( 'core.html#benchmark_scoring',
+                                                                                      'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.benchmark_window': ( 'core.html#benchmark_window',
+                                                                                     'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.estimate_memory': ( 'core.html#estimate_memory',
+                                                                                    'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.gen_MSAs': ('core.html#gen_msas', 'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.profile_run': ('core.html#profile_run', 'Iterative_masking/core.py'),
+                                        'Iterative_masking.core.token_memory': ('core.html#token_memory', 'Iterative_masking/core.py')},
+            'Iterative_masking.dataset': { 'Iterative_masking.dataset.GeneratedMSAs': ( 'dataset.html#generatedmsas',
+                                                                                        'Iterative_masking/dataset.py'),
+                                           'Iterative_masking.dataset.GeneratedMSAs.__init__': ( 'dataset.html#generatedmsas.__init__',
+                                                                                                 'Iterative_masking/dataset.py'),
+                                           'Iterative_masking.dataset.GeneratedMSAs.__iter__': ( 'dataset.html#generatedmsas.__iter__',
+                                                                                                 'Iterative_masking/dataset.py'),
+                                           'Iterative_masking.dataset.GeneratedMSAs._next': ( 'dataset.html#generatedmsas._next',
+                                                                                              'Iterative_masking/dataset.py'),
+                                           'Iterative_masking.dataset.GeneratedMSAs._produce': ( 'dataset.html#generatedmsas._produce',
+                                                                                                 'Iterative_masking/dataset.py'),
+                                           'Iterative_masking.dataset.GeneratedMSAs._sample': ( 'dataset.html#generatedmsas._sample',
+                                                                                                'Iterative_masking/dataset.py'),
+                                           'Iterative_masking.dataset.GeneratedMSAs.generate_batch': ( 'dataset.html#generatedmsas.generate_batch',
+                                                                                                       'Iterative_masking/dataset.py')},
+            'Iterative_masking.serve': { 'Iterative_masking.serve.GenerationClient': ( 'serve.html#generationclient',
+                                                                                       'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationClient.__init__': ( 'serve.html#generationclient.__init__',
+                                                                                                'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationClient._call': ( 'serve.html#generationclient._call',
+                                                                                             'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationClient.generate': ( 'serve.html#generationclient.generate',
+                                                                                                'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationClient.metrics': ( 'serve.html#generationclient.metrics',
+                                                                                               'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer': ( 'serve.html#generationserver',
+                                                                                       'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.__init__': ( 'serve.html#generationserver.__init__',
+                                                                                                'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer._loop': ( 'serve.html#generationserver._loop',
+                                                                                             'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer._next_batch': ( 'serve.html#generationserver._next_batch',
+                                                                                                   'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer._rows': ( 'serve.html#generationserver._rows',
+                                                                                             'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer._run_batch': ( 'serve.html#generationserver._run_batch',
+                                                                                                  'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer._sample': ( 'serve.html#generationserver._sample',
+                                                                                               'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer._tokens': ( 'serve.html#generationserver._tokens',
+                                                                                               'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.generate': ( 'serve.html#generationserver.generate',
+                                                                                                'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.make_request': ( 'serve.html#generationserver.make_request',
+                                                                                                    'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.metrics': ( 'serve.html#generationserver.metrics',
+                                                                                               'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.start': ( 'serve.html#generationserver.start',
+                                                                                             'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.stop': ( 'serve.html#generationserver.stop',
+                                                                                            'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.submit': ( 'serve.html#generationserver.submit',
+                                                                                              'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.GenerationServer.url': ( 'serve.html#generationserver.url',
+                                                                                           'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.StandInModel': ('serve.html#standinmodel', 'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.StandInModel.__init__': ( 'serve.html#standinmodel.__init__',
+                                                                                            'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.StandInModel.generate_MSA': ( 'serve.html#standinmodel.generate_msa',
+                                                                                                'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.StandInModel.generate_MSA_context': ( 'serve.html#standinmodel.generate_msa_context',
+                                                                                                        'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve._Request': ('serve.html#_request', 'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve._Request.__init__': ( 'serve.html#_request.__init__',
+                                                                                        'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve._make_handler': ( 'serve.html#_make_handler',
+                                                                                    'Iterative_masking/serve.py'),
+                                         'Iterative_masking.serve.serve_MSAs': ('serve.html#serve_msas', 'Iterative_masking/serve.py')},
+            'Iterative_masking.shards': { 'Iterative_masking.shards._axis': ('shards.html#_axis', 'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.array_hash': ('shards.html#array_hash', 'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.load_shards': ( 'shards.html#load_shards',
+                                                                                    'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.merge_MSAs': ('shards.html#merge_msas', 'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.merge_shards': ( 'shards.html#merge_shards',
+                                                                                     'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.plan_MSAs': ('shards.html#plan_msas', 'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.plan_shards': ( 'shards.html#plan_shards',
+                                                                                    'Iterative_masking/shards.py'),
+                                          'Iterative_masking.shards.write_manifest': ( 'shards.html#write_manifest',
+                                                                                       'Iterative_masking/shards.py')},
+            'Iterative_masking.store': { 'Iterative_masking.store.HammingIndex': ('store.html#hammingindex', 'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.__init__': ( 'store.html#hammingindex.__init__',
+                                                                                            'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.__len__': ( 'store.html#hammingindex.__len__',
+                                                                                           'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex._masked_distances': ( 'store.html#hammingindex._masked_distances',
+                                                                                                     'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.distances': ( 'store.html#hammingindex.distances',
+                                                                                             'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.knn': ( 'store.html#hammingindex.knn',
+                                                                                       'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.open': ( 'store.html#hammingindex.open',
+                                                                                        'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.pack': ( 'store.html#hammingindex.pack',
+                                                                                        'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.sample_strata': ( 'store.html#hammingindex.sample_strata',
+                                                                                                 'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.strata': ( 'store.html#hammingindex.strata',
+                                                                                          'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.HammingIndex.stratified': ( 'store.html#hammingindex.stratified',
+                                                                                              'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore': ('store.html#tokenstore', 'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.__init__': ( 'store.html#tokenstore.__init__',
+                                                                                          'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.__len__': ( 'store.html#tokenstore.__len__',
+                                                                                         'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.build': ( 'store.html#tokenstore.build',
+                                                                                       'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.gather': ( 'store.html#tokenstore.gather',
+                                                                                        'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.open': ( 'store.html#tokenstore.open',
+                                                                                      'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.sample': ( 'store.html#tokenstore.sample',
+                                                                                        'Iterative_masking/store.py'),
+                                         'Iterative_masking.store.TokenStore.shape': ( 'store.html#tokenstore.shape',
+                                                                                       'Iterative_masking/store.py'),
+                                         'Iterative_masking.store._hamming': ('store.html#_hamming', 'Iterative_masking/store.py'),
+                                         'Iterative_masking.store._popcount64': ('store.html#_popcount64', 'Iterative_masking/store.py')},
+            'Iterative_masking.weights': { 'Iterative_masking.weights.WeightStore': ( 'weights.html#weightstore',
+                                                                                      'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights.WeightStore.__init__': ( 'weights.html#weightstore.__init__',
+                                                                                               'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights.WeightStore.build_model': ( 'weights.html#weightstore.build_model',
+                                                                                                  'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights.WeightStore.convert': ( 'weights.html#weightstore.convert',
+                                                                                              'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights.WeightStore.save': ( 'weights.html#weightstore.save',
+                                                                                           'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights.WeightStore.state_dict': ( 'weights.html#weightstore.state_dict',
+                                                                                                 'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights._SkipInit': ( 'weights.html#_skipinit',
+                                                                                    'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights._SkipInit.__torch_function__': ( 'weights.html#_skipinit.__torch_function__',
+                                                                                                       'Iterative_masking/weights.py'),
+                                           'Iterative_masking.weights.convert_weights': ( 'weights.html#convert_weights',
+                                                                                          'Iterative_masking/weights.py')}}}
@@ -1,7 +1,8 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../00_core.ipynb.
 
 # %% auto 0
-__all__ = ['DEVICE', 'DC', 'IM_MSA_Transformer', 'gen_MSAs']
+__all__ = ['DEVICE', 'DC', 'estimate_memory', 'IM_MSA_Transformer', 'profile_run', 'benchmark_window', 'benchmark_burn_in',
+           'benchmark_mask_schedule', 'benchmark_scoring', 'token_memory', 'gen_MSAs']
 
 # %% ../00_core.ipynb 2
 import numpy as np
@@ -14,6 +15,9 @@ from typing import List, Tuple
 import string
 from warnings import warn
 from tqdm import tqdm
+from .store import TokenStore, HammingIndex
+from .weights import WeightStore
+from .shards import write_manifest
 
 torch.set_grad_enabled(False)
 
@@ -34,7 +38,16 @@ DEVICE = torch.device(DEVICE)
 print(DEVICE)
 
 def DC(x):
-    return x.detach().clone().cpu()
+    # A single copy: to the cpu for tensors on the GPU, a clone for tensors already on the cpu
+    return x.detach().to("cpu", copy=True)
+
+def estimate_memory(rows, length, embed_dim=768, heads=12, batch=1):
+    """
+    Rough estimate (in bytes, float32) of the memory used by one forward pass of MSA Transformer on `batch` MSAs
+    of `rows` sequences and `length` columns: the activations and logits of one layer plus the row
+    (heads x length x length) and column (heads x length x rows x rows) attention maps.
+    """
+    return 4 * batch * (rows * length * (4 * embed_dim + 33) + heads * length**2 + heads * length * rows**2)
 
 # Iterative masking MSA-Transformer
 class IM_MSA_Transformer:
@@ -46,10 +59,24 @@ class IM_MSA_Transformer:
                  num=None,
                  filepath=None,
                  DEVICE=DEVICE,
-                 pretrained_model_path=None):
+                 pretrained_model_path=None,
+                 window=None,
+                 overlap=0,
+                 token_store=None,
+                 weights=None,
+                 burn_in=0,
+                 burn_in_layers=None,
+                 burn_in_context=None,
+                 mask_mode="iid"):
 
         self.iterations = iterations    # number of iterations used to generate the MSA
         self.p_mask = p_mask            # masking probability for the MSA generation
+        self.window = window            # number of columns given to the model at once (None = full length)
+        self.overlap = overlap          # number of columns shared by two consecutive windows
+        self.burn_in = burn_in                  # number of first iterations done with a cheaper forward pass
+        self.burn_in_layers = burn_in_layers    # number of layers used during the burn-in (None = all)
+        self.burn_in_context = burn_in_context  # number of context sequences used during the burn-in (None = all)
+        self.mask_mode = mask_mode              # how the masks of the iterations are drawn (see `self.mask_schedule`)
         #---------------------------------------------------------------------------------------
         # Delete lowercase characters and punctuations from a string (input fasta file)
         self.deletekeys = dict.fromkeys(string.ascii_lowercase)
@@ -60,7 +87,11 @@ class IM_MSA_Transformer:
         if filename is None or num is None or filepath is None:
             raise ValueError("`filepath`, `filename` and `num` must be specified to import the MSA")
         # Import Transformer model
-        self.msa_transformer, self.msa_alphabet = esm.pretrained.esm_msa1b_t12_100M_UR50S()
+        if weights is not None:
+            # Memory-mapped weights (see `WeightStore`), their pages are shared by the processes that use them
+            self.msa_transformer, self.msa_alphabet = WeightStore(weights).build_model()
+        else:
+            self.msa_transformer, self.msa_alphabet = esm.pretrained.esm_msa1b_t12_100M_UR50S()
         if pretrained_model_path is not None:
             self.msa_transformer.load_state_dict(torch.load(pretrained_model_path)["model_state_dict"])
         self.msa_transformer = self.msa_transformer.eval().to(DEVICE)
@@ -69,7 +100,8 @@ class IM_MSA_Transformer:
         print('MSA Transformer model imported')
 
         # Import MSA and convert it into tokens
-        self.msa_batch_labels, self.msa_batch_strs, self.msa_data, self.msa_batch_tokens = self.tokenize_msa(filename, num, filepath)
+        self._context_index = None
+        self.msa_batch_labels, self.msa_batch_strs, self.msa_data, self.msa_batch_tokens = self.tokenize_msa(filename, num, filepath, token_store)
         # Import tokens into cuda
         self.msa_batch_tokens = self.msa_batch_tokens.to(DEVICE)
     
@@ -96,11 +128,22 @@ class IM_MSA_Transformer:
 #                   USEFUL FUNCTIONS TO RUN THE MSA TRANSFORMER ON INFERENCE MODE
 #-----------------------------------------------------------------------------------------------------------------------
 
-    def tokenize_msa(self, filename, num, filepath):
+    def tokenize_msa(self, filename, num, filepath, token_store=None):
         # If filename is an array then it's the input MSA
+        # If token_store is a directory, the MSA is tokenized once in a memory-mapped `TokenStore` saved in that directory
+        # and `msa_data` is the store (the rows are gathered on demand with `self.gather_rows`)
         with torch.no_grad():
-            if isinstance(filename,np.ndarray):
-                msa_data = torch.Tensor(filename).type(torch.int64)
+            if token_store is not None and not isinstance(filename,np.ndarray):
+                if len(filename) != 1:
+                    raise ValueError("Only one MSA (`filename` of length 1) can be used with `token_store`")
+                msa_data = TokenStore.open(filepath + '/' + filename[0], token_store, self.msa_alphabet)
+                msa_batch_labels, msa_batch_strs = None, None
+                if num[0]==-1:
+                    num[0]=msa_data.shape[1]
+                print(f'We are using batch MSAs of {num[0]} sequences')
+                msa_batch_tokens = msa_data.gather(np.arange(min(num[0], msa_data.shape[1])))
+            elif isinstance(filename,np.ndarray):
+                msa_data = torch.as_tensor(filename).to(dtype=torch.int8)
                 if len(filename.shape) != 3:
                     raise ValueError("`filename` should be an array with 3 axes")
                 if num[0]==-1:
@@ -120,16 +163,41 @@ class IM_MSA_Transformer:
                 # Create tokens starting from MSA
                 msa_batch_labels, msa_batch_strs, msa_batch_tokens = self.msa_batch_converter(
                     msa_data)
-                msa_data = (msa_batch_tokens).clone()
+                # Tokens are stored as int8, they are converted to int64 only when given to the model
+                msa_data = msa_batch_tokens.to(dtype=torch.int8)
+                del msa_batch_tokens
                 if num[0]==-1:
-                    num[0]=msa_batch_tokens.shape[1]
+                    num[0]=msa_data.shape[1]
                 print(f'We are using batch MSAs of {num[0]} sequences')
-                msa_batch_tokens = msa_batch_tokens[:, :num[0], :]
+                msa_batch_tokens = msa_data[:, :num[0], :].clone()
 
             print('MSA converted into tokens tensor of size and type:')
             print(msa_batch_tokens.size(), msa_batch_tokens.dtype)
             return msa_batch_labels, msa_batch_strs, msa_data, msa_batch_tokens
 
+    #-------------------------------------------------------------------------------------------------------------------
+    def gather_rows(self, inds):
+        """
+        Outputs the sequences `inds` of the full tokenized MSA `self.msa_data` as a (cpu) tensor of shape
+        (batch, len(`inds`), length). If the MSA is in a `TokenStore` only these rows are read from the disk.
+        """
+        with torch.no_grad():
+            if isinstance(self.msa_data, TokenStore):
+                return self.msa_data.gather(inds)
+            return self.msa_data[:, inds, :]
+
+    def context_index(self):
+        """
+        Outputs the `HammingIndex` of the full MSA `self.msa_data`, used to select the context sequences closest to each
+        ancestor. It is built the first time it's needed (and saved next to the `TokenStore` if the MSA is in a store).
+        """
+        if self._context_index is None:
+            if isinstance(self.msa_data, TokenStore):
+                self._context_index = HammingIndex.open(self.msa_data)
+            else:
+                self._context_index = HammingIndex(self.msa_data[0].numpy())
+        return self._context_index
+
     #-------------------------------------------------------------------------------------------------------------------    
     def untokenize_msa(self, tokens):
         """
@@ -149,14 +217,13 @@ class IM_MSA_Transformer:
     #-------------------------------------------------------------------------------------------------------------------
     def print_tokens(self, tokens=None):
         """
-        Outputs (on the cpu) the input `tokens` of the MSA, detaching them from the GPU.
+        Outputs (on the cpu) the input `tokens` of the MSA as an int8 numpy array, detaching them from the GPU.
+        If the tokens are already int8 and on the cpu the array shares their memory (no copy).
         """
         with torch.no_grad():
             if tokens is None:
-                return ((self.msa_batch_tokens.detach().cpu()).to(
-                    dtype=torch.int8)).numpy()
-            else:
-                return ((tokens.detach().cpu()).to(dtype=torch.int8)).numpy()
+                tokens = self.msa_batch_tokens
+            return tokens.detach().to("cpu", torch.int8).numpy()
 
     #-------------------------------------------------------------------------------------------------------------------
     def compute_embeddings(self, tokens=None, lyrs=[12]):
@@ -168,8 +235,7 @@ class IM_MSA_Transformer:
         with torch.no_grad():
             if tokens is None:
                 tokens = self.msa_batch_tokens
-            if not tokens.is_cuda:
-                tokens = tokens.to(DEVICE)
+            tokens = tokens.to(DEVICE, torch.int64)
             results = self.msa_transformer(tokens,
                                            repr_layers=lyrs,
                                            return_contacts=False)
@@ -186,11 +252,98 @@ class IM_MSA_Transformer:
         with torch.no_grad():
             if tokens is None:
                 tokens = self.msa_batch_tokens
-            if not tokens.is_cuda:
-                tokens = tokens.to(DEVICE)
+            tokens = tokens.to(DEVICE, torch.int64)
             msa_contacts = self.msa_transformer.predict_contacts(tokens).cpu()
         return msa_contacts
 
+    #-------------------------------------------------------------------------------------------------------------------
+    def forward_layers(self, tokens, n_layers=None):
+        """
+        Run the first `n_layers` layers of MSA Transformer (all of them if None) on `tokens` and return the
+        final (layer-normed) representations of shape (batch, rows, length, embed_dim), without applying the LM head.
+        `self.msa_transformer.lm_head` can then be applied only to the positions that are needed.
+        """
+        model = self.msa_transformer
+        with torch.no_grad():
+            tokens = tokens.to(DEVICE, torch.int64)
+            batch_size, num_alignments, seqlen = tokens.size()
+            padding_mask = tokens.eq(model.padding_idx)
+            if not padding_mask.any():
+                padding_mask = None
+            x = model.embed_tokens(tokens)
+            x += model.embed_positions(tokens.view(batch_size * num_alignments, seqlen)).view(x.size())
+            if model.msa_position_embedding is not None:
+                x += model.msa_position_embedding[:, :num_alignments]
+            x = model.emb_layer_norm_before(x)
+            x = model.dropout_module(x)
+            if padding_mask is not None:
+                x = x * (1 - padding_mask.unsqueeze(-1).type_as(x))
+            # B x R x C x D -> R x C x B x D
+            x = x.permute(1, 2, 0, 3)
+            for layer in model.layers[:n_layers]:
+                x = layer(x, self_attn_padding_mask=padding_mask, need_head_weights=False)
+            x = model.emb_layer_norm_after(x)
+        return x.permute(2, 0, 1, 3)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def score_sequences(self, sequences, context=None, positions_per_pass=1, batch_size=32, reduce=True):
+        """
+        Score the `sequences` (tokens of shape (num sequences, length)) with their pseudo-log-likelihood under
+        MSA Transformer, using `context` (tokens of shape (1, context depth, length)) as context MSA (or no context).
+        The tokens can be tensors (on any device, e.g. rows of `self.msa_batch_tokens`) or arrays.
+
+        `positions_per_pass`:  number of positions of a sequence masked at the same time. If 1 the exact
+                               pseudo-log-likelihood is computed (one masked position per forward pass), if larger
+                               the positions are split into `ceil(length/positions_per_pass)` groups of evenly spaced
+                               positions that are masked together (cheaper approximation).
+
+        `batch_size`:          number of masking patterns (of one or several sequences) given to the model at once.
+
+        `reduce`:              if True returns the pseudo-log-likelihood of each sequence (shape (num sequences,)),
+                               otherwise the log-probability of the true token at each position (shape
+                               (num sequences, length), the first token is 0).
+        """
+        with torch.no_grad():
+            # Tensors (possibly on the device) are used directly, other array-likes are converted with numpy
+            as_tokens = lambda x: (x if isinstance(x, torch.Tensor) else torch.as_tensor(np.asarray(x))).to(DEVICE, torch.int64)
+            sequences = as_tokens(sequences)
+            if context is None:
+                context = torch.zeros((1, 0, sequences.shape[1]), dtype=torch.int64)
+            context = as_tokens(context)
+            n_seqs, length = sequences.shape[0], sequences.shape[1] - 1
+            n_groups = -(-length // positions_per_pass)
+            # Group g masks the positions 1+g, 1+g+n_groups, 1+g+2*n_groups, ... (padded with -1)
+            pos = torch.arange(1, length + 1)
+            groups = torch.full((n_groups, positions_per_pass), -1, dtype=torch.int64)
+            for g in range(n_groups):
+                groups[g, :len(pos[g::n_groups])] = pos[g::n_groups]
+            groups = groups.to(DEVICE)
+            # All the (sequence, group) masking patterns, given to the model in batches of `batch_size`
+            patterns = torch.cartesian_prod(torch.arange(n_seqs), torch.arange(n_groups)).to(DEVICE)
+            log_probs = torch.zeros((n_seqs, length + 1), dtype=torch.float32, device=DEVICE)
+            for start in range(0, len(patterns), batch_size):
+                seq_idx, grp_idx = patterns[start:start + batch_size].T
+                b = len(seq_idx)
+                targets = groups[grp_idx]
+                valid = targets >= 0
+                targets = targets.clamp(min=0)
+                rows = torch.arange(b, device=DEVICE)[:, None].expand_as(targets)
+                masked = sequences[seq_idx].clone()
+                masked[rows[valid], targets[valid]] = self.msa_alphabet.mask_idx
+                tokens = torch.cat((context.expand(b, -1, -1), masked[:, None, :]), dim=1)
+                # Representations of the masked sequence only, the LM head is applied only on the masked positions
+                x = self.forward_layers(tokens)[:, -1, :, :]
+                logits = self.msa_transformer.lm_head(x[rows, targets])
+                lp = torch.log_softmax(logits.float(), dim=-1)
+                true = sequences[seq_idx[:, None], targets]
+                lp = lp.gather(-1, true[:, :, None])[:, :, 0]
+                log_probs[seq_idx[:, None].expand_as(targets)[valid], targets[valid]] = lp[valid]
+                del x, logits, tokens, masked
+        log_probs = log_probs.cpu().numpy()
+        if reduce:
+            return log_probs.sum(axis=1)
+        return log_probs
+
     #-------------------------------------------------------------------------------------------------------------------
     @njit(parallel=True)
     def Weights_Phylogeny(tkn, delta=0.8):
@@ -232,44 +385,177 @@ class IM_MSA_Transformer:
     
 
     #-------------------------------------------------------------------------------------------------------------------
-    def generate_MSA(self, MSA_tokens, mask_idx=32, use_pdf=False, sample_all=False, T=1, rand_perm=False):
+    def column_windows(self, length, window, overlap=0):
         """
-        Generate a new MSA by masking some entries of the original MSA and
-        re-predicting them through MSA Transformer.
+        Split the `length` columns of the MSA (the first token excluded) into windows of `window` columns,
+        where two consecutive windows share `overlap` columns.
+        Returns a list of tuples `(start, stop, lo, hi)` with the token indices of each window (`start:stop`) and of
+        its interior (`lo:hi`). The interiors do not overlap and together they cover all the columns: the first
+        `overlap//2` and the last `overlap - overlap//2` columns of each window are only used as context.
+        """
+        if overlap < 0 or overlap >= window:
+            raise ValueError("`overlap` must be non-negative and smaller than `window`")
+        if window >= length:
+            return [(1, length + 1, 1, length + 1)]
+        stride = window - overlap
+        starts = list(range(0, length - window, stride)) + [length - window]
+        windows = []
+        for k, start in enumerate(starts):
+            lo = 0 if k == 0 else windows[-1][3] - 1
+            hi = length if k == len(starts) - 1 else start + overlap // 2 + stride
+            windows.append((start + 1, start + window + 1, lo + 1, hi + 1))
+        return windows
+
+    def burn_in_step(self, i):
+        """
+        Number of layers and of context sequences (None = all of them) used at iteration `i` (starting from 0): during
+        the first `self.burn_in` iterations the tokens are predicted by the first `self.burn_in_layers` layers of the
+        model (the LM head is applied to their output) with only the first `self.burn_in_context` sequences of the
+        context, then the full model and context are used.
+        """
+        if i < self.burn_in:
+            return self.burn_in_layers, self.burn_in_context
+        return None, None
 
-        `MSA_tokens`: input tokens.
+    def mask_schedule(self, shape, iters, mode=None):
+        """
+        Masks (bool tensor of shape (`iters`,) + `shape` on the device, True = masked) of all the iterations of a run,
+        drawn at once with the masking probability `self.p_mask` (a float or a tensor of probabilities per column) and
+        the mode `mode` (`self.mask_mode` if None):
+        |__ "iid": each entry is masked independently at each iteration with probability `p_mask`.
+        |__ "stratified": the iterations are split in blocks and each entry is masked exactly once per block, at an
+                          iteration drawn uniformly in the block.
+        |__ "permutation": each entry is masked at the first iteration of each block, the phases of the entries of
+                           an MSA are spread evenly in [0, 1) (by a random permutation of the rows of each column and
+                           of the columns), so that the same number of entries of each column and of the MSA (up to
+                           one, with a float `p_mask`) is masked at each iteration, even with a single row.
+        With "stratified" and "permutation" the blocks of an entry follow a clock `p_mask`*i + phase (phase in [0, 1)),
+        a new block starts each time the clock crosses an integer: the blocks last floor(1/`p_mask`) or
+        ceil(1/`p_mask`) iterations and each entry is masked at the rate `p_mask`, as with "iid". No entry
+        stays unmasked for more than 2*ceil(1/`p_mask`)-1 (resp. ceil(1/`p_mask`)) iterations (the entries with
+        `p_mask`=0 are never masked).
+        The generation functions use these masks only if `self.mask_mode` is not "iid" (otherwise the masks are drawn
+        at each iteration by `self.generate_MSA`, as in the original algorithm).
+        """
+        mode = self.mask_mode if mode is None else mode
+        shape = tuple(shape)
+        p = torch.as_tensor(self.p_mask, dtype=torch.float32).to(DEVICE)
+        with torch.no_grad():
+            if mode == "iid":
+                masks = torch.rand((iters,) + shape, device=DEVICE) <= p
+            elif mode in ("stratified", "permutation"):
+                rate = torch.where(p > 0, p, torch.ones_like(p)).clamp(max=1).expand(shape)
+                if mode == "permutation":
+                    # Rank of each entry among the rows of its column and rank of its column, the phases of the
+                    # rows x columns entries of an MSA are spread evenly in [0, 1) (the columns are not in lockstep)
+                    rows = torch.rand(shape, device=DEVICE).argsort(dim=1).argsort(dim=1)
+                    cols = torch.rand(shape[:1] + (1,) + shape[2:], device=DEVICE).argsort(dim=-1).argsort(dim=-1)
+                    phase = (rows + (cols + 0.5) / shape[-1]) / shape[1]
+                    # Index of the block of each iteration, an entry is masked when it changes
+                    steps = torch.arange(iters + 1, device=DEVICE, dtype=torch.float32).view((-1,) + (1,) * len(shape))
+                    blocks = torch.floor(steps * rate + phase)
+                    masks = blocks[1:] != blocks[:-1]
+                else:
+                    phase = torch.rand(shape, device=DEVICE)
+                    # Block k of an entry covers the iterations [ceil((k-phase)/p), ceil((k+1-phase)/p)), the blocks
+                    # overlapping the run are drawn in one shot (the draws before iteration 0 or after the end are dropped)
+                    n_blocks = int(np.ceil(iters * rate.max().item())) + 1
+                    k = torch.arange(n_blocks + 1, device=DEVICE, dtype=torch.float32).view((-1,) + (1,) * len(shape))
+                    starts = torch.ceil((k - phase) / rate)
+                    draws = starts[:-1] + torch.floor(torch.rand((n_blocks,) + shape, device=DEVICE) * (starts[1:] - starts[:-1]))
+                    draws = torch.where((draws >= 0) & (draws < iters), draws, torch.full_like(draws, iters)).long()
+                    masks = torch.zeros((iters + 1,) + shape, dtype=torch.bool, device=DEVICE)
+                    masks.scatter_(0, draws, True)
+                    masks = masks[:iters]
+                masks &= (p > 0).expand(shape)
+            else:
+                raise ValueError(f"Unknown mask mode {mode}, use 'iid', 'stratified' or 'permutation'")
+        return masks
 
-        `p_mask`:     probability that an entry of the MSA is masked.
+    #-------------------------------------------------------------------------------------------------------------------
+    def predict_tokens(self, masked_msa_tokens, msa_tokens=None, use_pdf=False, T=1, rand_perm=False, skip_rows=0, collect=False,
+                       n_layers=None):
+        """
+        Predict the tokens of `masked_msa_tokens` through MSA Transformer, either taking the argmax of the logits
+        or sampling them from the logits pdf (`use_pdf`=True) at temperature `T`. Only the rows after the first
+        `skip_rows` ones are returned (e.g. to skip the context MSA).
 
-        `mask_idx`:   masking index (as interpreted by the model), for MSA-Tr it's 32.
+        If `self.window` is not None and smaller than the length of the MSA, the columns are split into overlapping
+        windows (see `self.column_windows`) and each window is given to the model separately: the masked tokens
+        are used only in the interior of the window while its borders are taken from the (unmasked) `msa_tokens`.
+        The predictions of the interiors are then stitched back together.
 
-        `use_pdf`:    if it's True the function sample the token from the logits pdf 
-                    instead of getting the argmax (greedy sampling).
+        If `collect` is True it also returns (on the cpu) the contact maps (batch, length, length) predicted in the
+        same forward pass and the embeddings of the last layer averaged over the columns (batch, rows, embed_dim) of
+        the returned rows. With windows, the contacts of the pairs of columns seen in several windows are averaged
+        and the pairs of columns never seen in the same window are 0.
 
-        `sample_all`: if True all the new tokens are obtained from the logits (both
-                    the masked and the non masked), if False the non masked tokens
-                    are left untouched and only the masked ones are changed.
+        If `n_layers` is not None, only the first `n_layers` layers of the model are used (not when `collect` is True).
+        """
+        with torch.no_grad():
+            length = masked_msa_tokens.shape[2] - 1
+            if self.window is None or self.window >= length:
+                out = self.predict_window(masked_msa_tokens, use_pdf=use_pdf, T=T, rand_perm=rand_perm,
+                                          skip_rows=skip_rows, collect=collect, n_layers=n_layers)
+                if not collect:
+                    return out
+                new_msa_tokens, contacts, representations = out
+                return new_msa_tokens, contacts.cpu(), representations[:, :, 1:, :].mean(dim=2).cpu()
+            if msa_tokens is None:
+                raise ValueError("`msa_tokens` must be given to generate the MSA with windows")
+            new_msa_tokens = torch.zeros_like(masked_msa_tokens[:, skip_rows:, :])
+            if collect:
+                contacts = torch.zeros((masked_msa_tokens.shape[0], length, length), device=DEVICE)
+                counts = torch.zeros((length, length), device=DEVICE)
+                embeddings = 0
+            for start, stop, lo, hi in self.column_windows(length, self.window, self.overlap):
+                window_tokens = torch.cat((msa_tokens[:, :, :1], msa_tokens[:, :, start:stop]), dim=2)
+                window_tokens[:, :, 1+lo-start:1+hi-start] = masked_msa_tokens[:, :, lo:hi]
+                window_pred = self.predict_window(window_tokens, use_pdf=use_pdf, T=T, rand_perm=rand_perm,
+                                                  skip_rows=skip_rows, collect=collect, n_layers=n_layers)
+                if collect:
+                    window_pred, window_contacts, window_repr = window_pred
+                    # Contacts are indexed without the first token: token `t` is the contact index `t-1`
+                    contacts[:, start-1:stop-1, start-1:stop-1] += window_contacts
+                    counts[start-1:stop-1, start-1:stop-1] += 1
+                    embeddings = embeddings + window_repr[:, :, 1+lo-start:1+hi-start, :].sum(dim=2)
+                    del window_contacts, window_repr
+                new_msa_tokens[:, :, lo:hi] = window_pred[:, :, 1+lo-start:1+hi-start].to(new_msa_tokens.dtype)
+                del window_tokens, window_pred
+        if collect:
+            return new_msa_tokens, (contacts / counts.clamp(min=1)).cpu(), (embeddings / length).cpu()
+        return new_msa_tokens
 
-        `T`:          Temperature of sampling from the pdf of output logits.
-        
-        `rand_perm`:    if True it randomly permutes the MSA sequences and change it back after the generation.
+    def predict_window(self, masked_msa_tokens, use_pdf=False, T=1, rand_perm=False, skip_rows=0, collect=False, n_layers=None):
+        """
+        Run MSA Transformer on `masked_msa_tokens` and return the new tokens (argmax or sampled from the pdf at
+        temperature `T`) of all the rows after the first `skip_rows`.
+        If `collect` is True it also returns the contacts and the representations of the last layer (of the same rows)
+        computed in the same forward pass.
+        If `n_layers` is not None (and `collect` is False) the LM head is applied to the output of the first `n_layers`
+        layers (see `self.forward_layers`) instead of the last one.
         """
         with torch.no_grad():
-            if not MSA_tokens.is_cuda:
-                MSA_tokens = MSA_tokens.to(DEVICE)
-            mask = ((torch.rand(MSA_tokens.shape) > self.p_mask).type(
-                torch.uint8)).to(DEVICE)
-            masked_msa_tokens = MSA_tokens * mask + mask_idx * (1 - mask)
+            last_layer = len(self.msa_transformer.layers)
             if rand_perm:
                 inds = torch.randperm(masked_msa_tokens.shape[1])
                 masked_msa_tokens = masked_msa_tokens[:, inds, :]
-            results = self.msa_transformer(masked_msa_tokens,
-                                           repr_layers=[12],
-                                           return_contacts=False)
+            if n_layers is not None and not collect:
+                results = {"logits": self.msa_transformer.lm_head(self.forward_layers(masked_msa_tokens, n_layers))}
+            else:
+                results = self.msa_transformer(masked_msa_tokens.to(torch.int64),
+                                               repr_layers=[last_layer],
+                                               return_contacts=collect)
             results1 = results["logits"]
+            if collect:
+                contacts = results["contacts"]
+                representations = results["representations"][last_layer]
             if rand_perm:
                 inds_backward = torch.argsort(inds)
                 results1 = results1[:,inds_backward,:,:]
+                if collect:
+                    representations = representations[:,inds_backward,:,:]
+            results1 = results1[:,skip_rows:,:,:]
             msa_logits = self.softmax_tensor(x=results1, axis=3, T=T)
             if use_pdf == False:
                 new_msa_tokens = torch.argmax(msa_logits, dim=3)
@@ -293,16 +579,71 @@ class IM_MSA_Transformer:
                 new_msa_tokens = torch.minimum(torch.amin(idxs, axis=3),
                                                maxval)
                 del cum, idxs, idxs1, sample
+        del results, results1, msa_logits
+        if collect:
+            return new_msa_tokens, contacts, representations[:,skip_rows:,:,:]
+        return new_msa_tokens
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def generate_MSA(self, MSA_tokens, mask_idx=32, use_pdf=False, sample_all=False, T=1, rand_perm=False, collect=False, n_layers=None,
+                     mask=None):
+        """
+        Generate a new MSA by masking some entries of the original MSA and
+        re-predicting them through MSA Transformer.
+
+        `MSA_tokens`: input tokens.
+
+        `p_mask`:     probability that an entry of the MSA is masked.
+
+        `mask_idx`:   masking index (as interpreted by the model), for MSA-Tr it's 32.
+
+        `use_pdf`:    if it's True the function sample the token from the logits pdf 
+                    instead of getting the argmax (greedy sampling).
+
+        `sample_all`: if True all the new tokens are obtained from the logits (both
+                    the masked and the non masked), if False the non masked tokens
+                    are left untouched and only the masked ones are changed.
+
+        `T`:          Temperature of sampling from the pdf of output logits.
+        
+        `rand_perm`:    if True it randomly permutes the MSA sequences and change it back after the generation.
+
+        `collect`:    if True it also returns the contacts and the pooled embeddings of the forward pass (see `self.predict_tokens`).
+
+        `n_layers`:   if not None, only the first `n_layers` layers of the model are used (see `self.burn_in_step`).
+
+        `mask`:       bool tensor (True = masked) with the shape of `MSA_tokens`, e.g. from `self.mask_schedule`, if None
+                    the entries are masked independently with probability `p_mask`.
+
+        If `self.window` is not None the columns are generated by overlapping windows (see `self.predict_tokens`).
+        """
+        with torch.no_grad():
+            if not MSA_tokens.is_cuda:
+                MSA_tokens = MSA_tokens.to(DEVICE)
+            # The tokens keep the dtype of `MSA_tokens` (int8 in this class), only the model input is int64
+            if mask is None:
+                mask = (torch.rand(MSA_tokens.shape) > self.p_mask).to(DEVICE)
+            else:
+                mask = ~mask.to(DEVICE)
+            masked_msa_tokens = MSA_tokens.masked_fill(~mask, mask_idx)
+            new_msa_tokens = self.predict_tokens(masked_msa_tokens, MSA_tokens, use_pdf=use_pdf, T=T, rand_perm=rand_perm,
+                                                 collect=collect, n_layers=n_layers)
+            if collect:
+                new_msa_tokens, contacts, embeddings = new_msa_tokens
+            new_msa_tokens = new_msa_tokens.to(MSA_tokens.dtype)
             if sample_all == False:
-                  new_msa_tokens = MSA_tokens * mask + new_msa_tokens * (1 - mask)
+                  new_msa_tokens = torch.where(mask, MSA_tokens, new_msa_tokens)
             new_msa_tokens[:, :, 0] = 0
-        del mask, masked_msa_tokens, results, msa_logits, results1
+        del mask, masked_msa_tokens
+        if collect:
+            return new_msa_tokens, contacts, embeddings
         return new_msa_tokens
 
 
     #-------------------------------------------------------------------------------------------------------------------
 
-    def generate_MSA_context(self, ancestor, context, mask_idx=32, use_pdf=False, sample_all=False, T=1, rand_perm=False):
+    def generate_MSA_context(self, ancestor, context, mask_idx=32, use_pdf=False, sample_all=False, T=1, rand_perm=False, collect=False,
+                             n_layers=None, n_context=None, mask=None):
         """
         Generate a sequences by masking some entries of the original ancestor sequences and
         re-predicting them through the transformer model (mask only `ancestor`, not the `context`).
@@ -325,6 +666,16 @@ class IM_MSA_Transformer:
         `T`:            Temperature of sampling from the pdf of output logits.
         
         `rand_perm`:    if True it randomly permutes the MSA sequences and change it back after the generation.
+
+        If `collect` is True it also returns the contacts (of the whole MSA, context included) and the pooled
+        embeddings (of the `ancestor` sequences) of the forward pass (see `self.predict_tokens`).
+
+        If `n_layers` and `n_context` are not None, only the first `n_layers` layers of the model and the first `n_context`
+        sequences of the `context` are used (see `self.burn_in_step`).
+
+        If `mask` (bool tensor with the shape of `ancestor`, True = masked) is not None it is used instead of a random mask.
+
+        If `self.window` is not None the columns are generated by overlapping windows (see `self.predict_tokens`).
         """
         with torch.no_grad():
 
@@ -333,78 +684,75 @@ class IM_MSA_Transformer:
             if not context.is_cuda:
                 context = context.to(DEVICE)
 
-            mask = ((torch.rand(ancestor.shape) > self.p_mask).type(torch.uint8)).to(DEVICE)
-            masked_ancestor = ancestor * mask + mask_idx * (1 - mask)
-            
-            masked_msa_tokens = torch.zeros((context.shape[0],
-                                             context.shape[1]+ancestor.shape[1],
-                                             context.shape[2]),
-                                             dtype=torch.int64).to(DEVICE)
-            masked_msa_tokens[:, :context.shape[1], :] = context
-            masked_msa_tokens[:, context.shape[1]:, :] = masked_ancestor
-            if rand_perm:
-                inds = torch.randperm(masked_msa_tokens.shape[1])
-                masked_msa_tokens = masked_msa_tokens[:, inds, :]
-            results = self.msa_transformer(masked_msa_tokens,
-                                           repr_layers=[12],
-                                           return_contacts=False)
-            results1 = results["logits"]
-            if rand_perm:
-                inds_backward = torch.argsort(inds)
-                results1 = results1[:,inds_backward,:,:]
-            results1 = results1[:,context.shape[1]:,:,:]
-            msa_logits = self.softmax_tensor(x=results1, axis=3, T=T)
-
-            if use_pdf == False:
-                new_generation = torch.argmax(msa_logits, dim=3)
+            if mask is None:
+                mask = (torch.rand(ancestor.shape) > self.p_mask).to(DEVICE)
             else:
-                Vals = torch.tensor([
-                    4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19,
-                    20, 21, 22, 23, 30],dtype=torch.int64)
-                maxval = Vals[-1].to(DEVICE)
-                msa_logits = msa_logits[:, :, :, Vals]
-                msa_logits = msa_logits / (torch.sum(msa_logits,
-                                                     axis=3)[:, :, :, None])
-                cum = torch.cumsum(msa_logits, dim=3)
-                idxs = torch.zeros_like(cum, dtype=torch.int64).to(DEVICE)
-                idxs1 = Vals[None, None, None, :].to(DEVICE)
-                idxs = idxs + idxs1
-                sample = (torch.rand(
-                    (cum.shape[0], cum.shape[1], cum.shape[2]))).to(DEVICE)
-                idxs[torch.gt(sample[:, :, :, None], cum)] = 100
-                new_generation = torch.minimum(torch.amin(idxs, axis=3),
-                                               maxval)
-                del cum, idxs, idxs1, sample
+                mask = ~mask.to(DEVICE)
+            masked_ancestor = ancestor.masked_fill(~mask, mask_idx)
+            
+            context = context[:, :n_context].to(ancestor.dtype)
+            masked_msa_tokens = torch.cat((context, masked_ancestor), dim=1)
+            msa_tokens = torch.cat((context, ancestor), dim=1)
+            new_generation = self.predict_tokens(masked_msa_tokens, msa_tokens, use_pdf=use_pdf, T=T,
+                                                 rand_perm=rand_perm, skip_rows=context.shape[1], collect=collect,
+                                                 n_layers=n_layers)
+            if collect:
+                new_generation, contacts, embeddings = new_generation
+            new_generation = new_generation.to(ancestor.dtype)
                 
             if sample_all == False:
-                  new_generation = ancestor * mask + new_generation * (1 - mask)
+                  new_generation = torch.where(mask, ancestor, new_generation)
             new_generation[:,:,0] = 0
 
-        del mask, masked_msa_tokens, results, results1, msa_logits
+        del mask, masked_msa_tokens, msa_tokens
+        if collect:
+            return new_generation, contacts, embeddings
         return new_generation
     
-    def generate_all_msa(self, msa_tokens, iters, use_pdf=False, T=1, save_all=False, rand_perm=False):
+    def generate_all_msa(self, msa_tokens, iters, use_pdf=False, T=1, save_all=False, rand_perm=False, collect=False):
         """
         Iterate the MSA generation process `iters` times starting from `msa_tokens` using the function `generate_MSA`.
         If `save_all` is True it saves all the generated sequences at each iter, otherwise it saves only the last one.
+        If `collect` is True it also returns the contacts and the pooled embeddings computed by the forward passes of the
+        saved iterations (the forward pass of iteration `i` gives the sequences saved at index `i`+1 when `save_all` is True).
+        The first `self.burn_in` iterations use a truncated model (see `self.burn_in_step`), except the collected ones.
+        The masks are drawn with `self.mask_schedule` if `self.mask_mode` is not "iid".
         """
-        lst_msa_tokens = [DC(msa_tokens)]
+        msa_tokens = msa_tokens.to(DEVICE, torch.int8)
+        masks = None if self.mask_mode == "iid" else self.mask_schedule(msa_tokens.shape, iters)
+        if save_all:
+            # The snapshots are copied (once) into a preallocated int8 tensor on the cpu
+            all_tokens = torch.empty((iters + 1,) + tuple(msa_tokens.shape), dtype=torch.int8)
+            all_tokens[0].copy_(msa_tokens)
+        lst_contacts, lst_embeddings = [], []
         for i in tqdm(range(iters)):
+            collect_i = collect and (save_all or i == iters - 1)
+            n_layers, _ = self.burn_in_step(i)
             msa_tokens = self.generate_MSA(
                                     MSA_tokens=msa_tokens,
                                     mask_idx=self.msa_alphabet.mask_idx,
                                     use_pdf=use_pdf,
                                     sample_all=False,
                                     T=T,
-                                    rand_perm=rand_perm)
+                                    rand_perm=rand_perm,
+                                    collect=collect_i,
+                                    n_layers=n_layers,
+                                    mask=None if masks is None else masks[i])
+            if collect_i:
+                msa_tokens, contacts, embeddings = msa_tokens
+                lst_contacts.append(contacts)
+                lst_embeddings.append(embeddings)
             if save_all:
-                lst_msa_tokens.append(DC(msa_tokens))
-        if save_all:
-            return torch.stack(lst_msa_tokens, dim=0)
-        return msa_tokens
+                all_tokens[i + 1].copy_(msa_tokens)
+        if not save_all:
+            all_tokens = msa_tokens
+        if collect:
+            return all_tokens, torch.stack(lst_contacts, dim=0), torch.stack(lst_embeddings, dim=0)
+        return all_tokens
 
     def generate_with_context_msa(self, ancestor, iters, use_pdf=False, T=1, all_context=(None,100),
-                                  use_rnd_ctx=False, use_two_msas=False, mode="same", warm_up=0, cool_down=None, save_all=False, rand_perm=False):
+                                  use_rnd_ctx=False, use_two_msas=False, mode="same", warm_up=0, cool_down=None, save_all=False, rand_perm=False,
+                                  collect=False):
         """
         Iterate the MSA generation process `iters` times starting from `ancestor` and using the context from `all_context`, it uses
         the function `generate_MSA_context`. If `save_all` is True it saves all the generated sequences at each iter, otherwise it saves
@@ -422,6 +770,9 @@ class IM_MSA_Transformer:
                                  sequences from the second MSA. `warm_up` is the number of iterations before starting to sample from the second MSA
                                  while `cool_down` is the number of iterations before the end after which the sampling from the first MSA is stopped
                                  (if `cool_down` is None it's equal to `warm_up`).
+        If `collect` is True it also returns the contacts and the pooled embeddings of the saved iterations (see `generate_all_msa`).
+        The first `self.burn_in` iterations use a truncated model and context (see `self.burn_in_step`), except the collected ones.
+        The masks are drawn with `self.mask_schedule` if `self.mask_mode` is not "iid".
         """
         if cool_down is None:
             cool_down = warm_up
@@ -441,9 +792,15 @@ class IM_MSA_Transformer:
         else:
             context = all_context
             
-        lst_ancestors = [DC(ancestor)]
+        ancestor = ancestor.to(DEVICE, torch.int8)
+        masks = None if self.mask_mode == "iid" else self.mask_schedule(ancestor.shape, iters)
+        if save_all:
+            all_tokens = torch.empty((iters + 1,) + tuple(ancestor.shape), dtype=torch.int8)
+            all_tokens[0].copy_(ancestor)
+        lst_contacts, lst_embeddings = [], []
         pbar = tqdm(range(iters))
         for i in pbar:
+            collect_i = collect and (save_all or i == iters - 1)
             if use_rnd_ctx:
                 if use_two_msas:
                     inds1 = torch.randperm(full_context_msa1.shape[1])
@@ -455,6 +812,7 @@ class IM_MSA_Transformer:
                 else:
                     inds = torch.randperm(full_context_msa.shape[1])[:num]
                     context = full_context_msa[:, inds, :]
+            n_layers, n_context = (None, None) if collect_i else self.burn_in_step(i)
             ancestor = self.generate_MSA_context(
                             ancestor=ancestor,
                             context=context,
@@ -462,19 +820,74 @@ class IM_MSA_Transformer:
                             use_pdf=use_pdf,
                             sample_all=False,
                             T=T,
-                            rand_perm=rand_perm)
+                            rand_perm=rand_perm,
+                            collect=collect_i,
+                            n_layers=n_layers,
+                            n_context=n_context,
+                            mask=None if masks is None else masks[i])
+            if collect_i:
+                ancestor, contacts, embeddings = ancestor
+                lst_contacts.append(contacts)
+                lst_embeddings.append(embeddings)
             if save_all:
-                lst_ancestors.append(DC(ancestor))
-        if save_all:
-            return torch.stack(lst_ancestors, dim=0)
-        return ancestor
+                all_tokens[i + 1].copy_(ancestor)
+        if not save_all:
+            all_tokens = ancestor
+        if collect:
+            return all_tokens, torch.stack(lst_contacts, dim=0), torch.stack(lst_embeddings, dim=0)
+        return all_tokens
+
+    def replica_count(self, msa_tokens, memory_budget, max_replicas=None):
+        """
+        Largest number of replicas of `msa_tokens` (batch, rows, length) that can be generated together (see
+        `self.generate_replicas`) with the estimated memory of their forward pass (see `estimate_memory`, with the
+        window length if `self.window` is not None) within `memory_budget` bytes. It is at least 1 and at most `max_replicas`.
+        """
+        batch, rows, length = msa_tokens.shape
+        if self.window is not None:
+            length = min(length, self.window + 1)
+        args = self.msa_transformer.args
+        memory = estimate_memory(rows, length, args.embed_dim, args.attention_heads, batch=batch)
+        replicas = int(memory_budget // memory)
+        if replicas < 1:
+            print(f"A single replica needs ~{memory/2**20:.0f} MiB, more than the memory budget")
+        if max_replicas is not None:
+            replicas = min(replicas, max_replicas)
+        return max(replicas, 1)
+
+    def generate_replicas(self, msa_tokens, iters, replicas=None, memory_budget=None, use_pdf=False, T=1, save_all=False,
+                          rand_perm=False, collect=False):
+        """
+        Run `replicas` independent chains of `generate_all_msa` starting from the same `msa_tokens` (batch, rows, length)
+        in a single loop: the input is tiled `replicas` times along the batch axis, so that each forward pass advances
+        all the chains and each replica gets its own masks and sampled tokens (with `rand_perm` the permutation of the
+        rows is shared by the replicas). If `replicas` is None it is chosen from `memory_budget` (in bytes, see
+        `self.replica_count`).
+        The tokens are returned with a replica axis after the iterations one: (`iters`+1, replicas, batch, rows, length)
+        int8 (on the cpu) if `save_all` is True, otherwise (replicas, batch, rows, length). If `collect` is True the
+        contacts and the embeddings (see `generate_all_msa`) have the same replica axis.
+        """
+        if replicas is None:
+            if memory_budget is None:
+                raise ValueError("Either `replicas` or `memory_budget` must be given")
+            replicas = self.replica_count(msa_tokens, memory_budget)
+            print(f"{replicas} replicas generated together")
+        batch = msa_tokens.shape[0]
+        tiled = msa_tokens.to(DEVICE, torch.int8).repeat(replicas, 1, 1)
+        out = self.generate_all_msa(tiled, iters, use_pdf=use_pdf, T=T, save_all=save_all, rand_perm=rand_perm,
+                                    collect=collect)
+        split = lambda x, axis: x.unflatten(axis, (replicas, batch))
+        if collect:
+            tokens, contacts, embeddings = out
+            return split(tokens, 1 if save_all else 0), split(contacts, 1), split(embeddings, 1)
+        return split(out, 1 if save_all else 0)
 
 #-----------------------------------------------------------------------------------------------------------------------
 #                   FUNCTIONS FOR THE MSA GENERATION TO REPLICATE THE EXPERIMENTS OF THE PAPER
 #-----------------------------------------------------------------------------------------------------------------------
 
     #-------------------------------------------------------------------------------------------------------------------
-    def NEW_MSA(self, use_pdf=False, simplified=False, sample_all=False, T=1):
+    def NEW_MSA(self, use_pdf=False, simplified=False, sample_all=False, T=1, collect=False):
         """
         Generate a new MSA by iteratively calling the masked MSA generator defined in: `self.generate_MSA`.
 
@@ -492,6 +905,13 @@ class IM_MSA_Transformer:
                     are left untouched and only the masked ones are changed.
 
         `T`:          Temperature of sampling from the pdf of output logits.
+
+        `collect`:    if True it also returns the contact maps (len(`self.iterations`), batch, length, length) and the
+                    embeddings averaged over the columns (len(`self.iterations`), batch, depth, embed_dim) computed
+                    by the forward pass of each saved iteration (no additional forward pass is needed).
+
+        The first `self.burn_in` iterations use a truncated model (see `self.burn_in_step`), except the collected ones.
+        The masks are drawn with `self.mask_schedule` if `self.mask_mode` is not "iid".
         """
         if self.iterations is None or self.p_mask is None:
             raise ValueError(
@@ -499,43 +919,50 @@ class IM_MSA_Transformer:
             )
         max_iter = self.iterations[-1]
         with torch.no_grad():
-            new_msa_tokens = self.msa_batch_tokens.clone()
+            new_msa_tokens = self.msa_batch_tokens.to(DEVICE, torch.int8, copy=True)
+            masks = None if self.mask_mode == "iid" else self.mask_schedule(new_msa_tokens.shape, max_iter)
             all_tokens = torch.zeros(
                 (len(self.iterations), self.msa_batch_tokens.shape[0],
                  self.msa_batch_tokens.shape[1],
                  self.msa_batch_tokens.shape[2]),
-                dtype=torch.int64)
-            if simplified:
-                all_tokens = all_tokens.to(dtype=torch.int8)
+                dtype=torch.int8, device="cpu" if simplified else DEVICE)
             if self.msa_alphabet.mask_idx != 32:
                 raise ValueError(
                     f"The token used for masking is {self.msa_alphabet.mask_idx} instead of 32"
                 )
             # Iterate the MSA generation process
             j = 0
+            lst_contacts, lst_embeddings = [], []
             for i in range(max_iter):
+                save = np.any((i + 1) == self.iterations)
                 new_msa_tokens = self.generate_MSA(
                     MSA_tokens=new_msa_tokens,
                     mask_idx=self.msa_alphabet.mask_idx,
-                    use_pdf=use_pdf, sample_all=sample_all, T=T)
-                if np.any((i + 1) == self.iterations):
+                    use_pdf=use_pdf, sample_all=sample_all, T=T,
+                    collect=collect and save,
+                    n_layers=self.burn_in_step(i)[0],
+                    mask=None if masks is None else masks[i])
+                if collect and save:
+                    new_msa_tokens, contacts, embeddings = new_msa_tokens
+                    lst_contacts.append(contacts)
+                    lst_embeddings.append(embeddings)
+                if save:
                     # Save the tokens at the specified iterations
-                    if simplified:
-                        all_tokens[j,
-                                   ...] = (new_msa_tokens.clone().detach().cpu()).to(
-                                       dtype=torch.int8)
-                    else:
-                        all_tokens[j, ...] = new_msa_tokens.clone()
+                    all_tokens[j].copy_(new_msa_tokens)
                     j += 1
         del new_msa_tokens
         if simplified:
-            return all_tokens.numpy()
-        else:
-            return all_tokens.to(DEVICE)
+            all_tokens = all_tokens.numpy()
+        if not collect:
+            return all_tokens
+        contacts, embeddings = torch.stack(lst_contacts, dim=0), torch.stack(lst_embeddings, dim=0)
+        if simplified:
+            return all_tokens, contacts.numpy(), embeddings.numpy()
+        return all_tokens, contacts, embeddings
 
 
     #-------------------------------------------------------------------------------------------------------------------
-    def Batch_MSA(self, use_pdf=False, simplified=False, repetitions=2, sample_all=False, T=1, phylo=False):
+    def Batch_MSA(self, use_pdf=False, simplified=False, repetitions=2, sample_all=False, T=1, phylo=False, collect=False):
         """
         Generate a full MSA by calling with different input MSAs the iterative MSA generator defined
         in: `self.NEW_MSA`.
@@ -558,53 +985,68 @@ class IM_MSA_Transformer:
         `T`:          Temperature of sampling from the pdf of output logits.
 
         `phylo`:            if True the start sequences are sampled from phylogeny weights instead of randomly.
+
+        `collect`:          if True it also returns the contact maps of each batch MSA (len(`self.iterations`), repetitions,
+                            batch, length, length) and the embeddings of each generated sequence averaged over the columns
+                            (len(`self.iterations`), batch, depth, embed_dim), see `self.NEW_MSA`.
         """
         with torch.no_grad():
-            ALL_tokens = self.msa_data
+            n_rows = self.msa_data.shape[1]
             depth = self.msa_batch_tokens.shape[1]
-            if repetitions * depth > ALL_tokens.shape[1]:
+            if repetitions * depth > n_rows:
                 all_tokens = np.zeros(
                     (len(self.iterations), self.msa_batch_tokens.shape[0],
-                     ALL_tokens.shape[1], self.msa_batch_tokens.shape[2]),
-                    dtype=np.int64)
+                     n_rows, self.msa_batch_tokens.shape[2]),
+                    dtype=np.int8)
             else:
                 all_tokens = np.zeros(
                     (len(self.iterations), self.msa_batch_tokens.shape[0],
                     self.msa_batch_tokens.shape[1] * repetitions,
                     self.msa_batch_tokens.shape[2]),
-                    dtype=np.int64)
-            if simplified:
-                all_tokens = all_tokens.astype('int8')
+                    dtype=np.int8)
 
+            # Only the indices of the shuffled MSA are kept, the rows of each batch are gathered when needed
             if not phylo:
-                ALL_tokens = ALL_tokens[:, torch.randperm(ALL_tokens.shape[1]), :]
+                indxs = torch.randperm(n_rows)
             else:
-                _ = self.Weights_Phylogeny(ALL_tokens[0, :20, :], delta=0.8)
-                phylo_w = self.Weights_Phylogeny(ALL_tokens[0, :, :], delta=0.8)
-                indxs = torch.multinomial(phylo_w, ALL_tokens.shape[1], replacement=True)
-                ALL_tokens = ALL_tokens[:, indxs, :]
+                phylo_tokens = self.msa_data.tokens if isinstance(self.msa_data, TokenStore) else self.msa_data[0]
+                _ = self.Weights_Phylogeny(phylo_tokens[:20, :], delta=0.8)
+                phylo_w = self.Weights_Phylogeny(phylo_tokens, delta=0.8)
+                indxs = torch.multinomial(phylo_w, n_rows, replacement=True)
             for i in range(repetitions):
                 ind = torch.arange(i * depth, (i + 1) * depth)
-                if (i + 1) * depth > ALL_tokens.shape[1]:
-                    ind = torch.arange(i * depth, ALL_tokens.shape[1])
-                self.msa_batch_tokens = ALL_tokens[:, ind, :]
+                if (i + 1) * depth > n_rows:
+                    ind = torch.arange(i * depth, n_rows)
+                self.msa_batch_tokens = self.gather_rows(indxs[ind])
                 self.msa_batch_tokens = self.msa_batch_tokens.to(DEVICE)
-                all_tokens[:, :,
-                           ind.numpy(), :] = self.NEW_MSA(use_pdf=use_pdf, simplified=simplified, sample_all=sample_all, T=T)
-                if (i + 1) * depth > ALL_tokens.shape[1]:
+                new_tokens = self.NEW_MSA(use_pdf=use_pdf, simplified=True, sample_all=sample_all, T=T, collect=collect)
+                if collect:
+                    new_tokens, contacts, embeddings = new_tokens
+                    if i == 0:
+                        all_contacts = []
+                        all_embeddings = np.zeros(all_tokens.shape[:3] + embeddings.shape[3:], dtype=np.float32)
+                    all_contacts.append(contacts)
+                    all_embeddings[:, :, ind.numpy(), :] = embeddings
+                all_tokens[:, :, ind.numpy(), :] = new_tokens
+                if (i + 1) * depth > n_rows:
                     break
+            ALL_tokens = self.gather_rows(indxs[:repetitions * depth])
 
+        if collect:
+            all_contacts = np.stack(all_contacts, axis=1)
+            if simplified:
+                return ALL_tokens.numpy(), all_tokens, all_contacts, all_embeddings
+            return ALL_tokens, torch.from_numpy(all_tokens).to(DEVICE), torch.from_numpy(all_contacts), torch.from_numpy(all_embeddings)
         if simplified:
-            return (ALL_tokens[:, :repetitions *
-                               depth, :].numpy()).astype('int8'), all_tokens
+            return ALL_tokens.numpy(), all_tokens
         else:
-            return ALL_tokens[:, :repetitions *
-                              depth, :], torch.from_numpy(all_tokens).to(DEVICE)
+            return ALL_tokens, torch.from_numpy(all_tokens).to(DEVICE)
 
     #-------------------------------------------------------------------------------------------------------------------
     # Generate new sequence in a Linear tree by reiterating the function `generate_MSA_context()` starting from the sequence:
     # `ancestor` (original sequence) and using the sequences in `context` as context MSA.
-    def Context_MSA(self, depth=None, ancestor=None, context=None, use_pdf=False, simplified=False, sample_all=False, print_all=True, T=1):
+    def Context_MSA(self, depth=None, ancestor=None, context=None, use_pdf=False, simplified=False, sample_all=False, print_all=True, T=1, n_strata=4,
+                    collect=False):
         """
         Generates a new MSA with context-generation by iterating the masking on the original ancestor sequence
         using: `self.generate_MSA_context`. It masks `ancestor` (original sequence) and uses the sequences in `context` as context MSA.
@@ -618,7 +1060,11 @@ class IM_MSA_Transformer:
 
         `ancestor`:     input sequence to be masked iteratively.
 
-        `context`:      context MSA (not masked).
+        `context`:      context MSA (not masked), or how it is selected from the full MSA for each ancestor (with
+                        `self.msa_batch_tokens.shape[1]` sequences):
+                        'tot-ran' (sampled randomly at each iteration), 'knn' (the sequences closest to the ancestor
+                        in Hamming distance) or 'strat' (sampled at each iteration with the same number of sequences
+                        from each of the `n_strata` groups of sequences sorted by distance from the ancestor).
 
         `use_pdf`:      if it's True the function sample the token from the logits pdf 
                         instead of getting the argmax (greedy sampling).
@@ -630,21 +1076,34 @@ class IM_MSA_Transformer:
         `T`:            Temperature of sampling from the pdf of output logits.
 
         `depth`:        number of generated sequences, if None the depth is the number of ancestor sequences.
+
+        `collect`:      if True it also returns the contact maps (batch, saved iterations, depth, length, length) of the
+                        MSAs (context and ancestor) and the embeddings of the generated sequences averaged over the columns
+                        (batch, saved iterations, depth, embed_dim), computed by the forward passes of the saved iterations.
+                        The first saved iteration is the first generation (the ancestor itself is not included).
+
+        The first `self.burn_in` iterations of each ancestor use a truncated model and only the first `self.burn_in_context`
+        sequences of the context (see `self.burn_in_step`), except the collected ones.
+        The masks of each ancestor are drawn with `self.mask_schedule` if `self.mask_mode` is not "iid".
         """
         with torch.no_grad():
             total_ran=False
+            ctx_mode=None
+            n_rows = self.msa_data.shape[1]
             if ancestor is None and context is None and depth is not None:
-                ALL_tokens = self.msa_data
-                ALL_tokens = ALL_tokens[:, torch.randperm(ALL_tokens.shape[1]), :]
-                ancestor = ALL_tokens[0,:depth,:]
-                ALL_tokens = ALL_tokens[:, torch.randperm(ALL_tokens.shape[1]), :]
-                context  = ALL_tokens[:,:self.msa_batch_tokens.shape[1],:]
+                ancestor = self.gather_rows(torch.randperm(n_rows)[:depth])[0].numpy()
+                context  = self.gather_rows(torch.randperm(n_rows)[:self.msa_batch_tokens.shape[1]]).numpy()
             elif depth is None:
                 depth = ancestor.shape[0]
                 if isinstance(context,np.ndarray):
                     total_ran=False
                 elif context=='tot-ran':
                     total_ran=True
+                elif context=='knn' or context=='strat':
+                    ctx_mode = context
+                    ctx_index = self.context_index()
+                    if ctx_mode == 'knn':
+                        ctx_inds = ctx_index.knn(ancestor, self.msa_batch_tokens.shape[1])
             else:
                 print('ERROR, either you give depth or you give ancestor and context')
 
@@ -652,47 +1111,260 @@ class IM_MSA_Transformer:
                  self.iterations[-1]+1,
                  depth,
                  ancestor.shape[1]),
-                dtype=torch.int64).to(DEVICE)
+                dtype=torch.int8, device=DEVICE)
 
-            ancestor = torch.from_numpy(ancestor).to(dtype=torch.int64)
-            if not total_ran:
-                context  = torch.from_numpy(context).to(dtype=torch.int64)
-            if total_ran:
-                ALL_tokens = self.msa_data
+            ancestor = torch.from_numpy(ancestor).to(dtype=torch.int8)
+            if not total_ran and ctx_mode is None:
+                context  = torch.from_numpy(context).to(dtype=torch.int8)
 
             all_tokens[0, 0, :, :] = ancestor
-
-            if simplified:
-                all_tokens = all_tokens.to(dtype=torch.int8)
             if self.msa_alphabet.mask_idx != 32:
                 raise ValueError(
                     f"The token used for masking is {self.msa_alphabet.mask_idx} instead of 32"
                 )
             
             # Iterate the MSA generation tree
+            all_contacts, all_embeddings = None, None
             for j in range(depth):
                 new_ancestor = all_tokens[0, 0, j, :]
+                masks = None if self.mask_mode == "iid" else self.mask_schedule((1, 1, new_ancestor.shape[0]), self.iterations[-1])
+                if ctx_mode == 'knn':
+                    context = (self.gather_rows(ctx_inds[j])).to(DEVICE)
+                elif ctx_mode == 'strat':
+                    strata = ctx_index.strata(ancestor[j].numpy(), n_strata)
                 for i in range(1,self.iterations[-1]+1):
                     if total_ran:
-                        context = (ALL_tokens[:, torch.randperm(ALL_tokens.shape[1])[:self.msa_batch_tokens.shape[1]], :]).to(DEVICE)
-                    new_ancestor = self.generate_MSA_context(ancestor=new_ancestor[None,None,:],context=context, mask_idx=self.msa_alphabet.mask_idx, use_pdf=use_pdf, sample_all=sample_all, T=T)
+                        context = (self.gather_rows(torch.randperm(n_rows)[:self.msa_batch_tokens.shape[1]])).to(DEVICE)
+                    elif ctx_mode == 'strat':
+                        context = (self.gather_rows(ctx_index.sample_strata(strata, self.msa_batch_tokens.shape[1]))).to(DEVICE)
+                    collect_i = collect and (print_all or i == self.iterations[-1])
+                    n_layers, n_context = (None, None) if collect_i else self.burn_in_step(i - 1)
+                    new_ancestor = self.generate_MSA_context(ancestor=new_ancestor[None,None,:],context=context, mask_idx=self.msa_alphabet.mask_idx, use_pdf=use_pdf, sample_all=sample_all, T=T,
+                                                             collect=collect_i, n_layers=n_layers, n_context=n_context,
+                                                             mask=None if masks is None else masks[i - 1])
+                    if collect_i:
+                        new_ancestor, contacts, embeddings = new_ancestor
+                        if all_contacts is None:
+                            n_saved = self.iterations[-1] if print_all else 1
+                            all_contacts = np.zeros((contacts.shape[0], n_saved, depth) + tuple(contacts.shape[1:]), dtype=np.float32)
+                            all_embeddings = np.zeros((embeddings.shape[0], n_saved, depth, embeddings.shape[-1]), dtype=np.float32)
+                        k = i - 1 if print_all else 0
+                        all_contacts[:, k, j] = contacts.numpy()
+                        all_embeddings[:, k, j] = embeddings[:, 0].numpy()
+                    new_ancestor = new_ancestor[0,0,:]
                     if print_all:
-                        all_tokens[0, i, j, :] = new_ancestor[0,0,:]
+                        all_tokens[0, i, j, :] = new_ancestor
                 if not print_all:
-                    all_tokens[0, -1, j, :] = new_ancestor[0,0,:]
+                    all_tokens[0, -1, j, :] = new_ancestor
                 # torch.cuda.empty_cache()
 
         if not print_all:
             all_tokens = all_tokens[:,torch.tensor([-1]),:,:]
 
+        if collect:
+            if simplified:
+                return self.print_tokens(context), self.print_tokens(all_tokens), all_contacts, all_embeddings
+            return context.to(DEVICE), all_tokens.to(DEVICE), torch.from_numpy(all_contacts), torch.from_numpy(all_embeddings)
         if simplified:
-            return ((context.detach().cpu()).to(dtype=torch.int8)).numpy(), ((all_tokens.detach().cpu()).to(dtype=torch.int8)).numpy()
+            return self.print_tokens(context), self.print_tokens(all_tokens)
         else:
             return context.to(DEVICE), all_tokens.to(DEVICE)
 
-# %% ../00_core.ipynb 6
+# %% ../00_core.ipynb 13
+import time
+import threading
+import resource
+
+def _rss():
+    "Resident memory (bytes) of the current process"
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def profile_run(fn, *args, device=DEVICE, **kwargs):
+    """
+    Run `fn(*args, **kwargs)` and return its output, the wall-clock time (in seconds) and the peak memory (in bytes)
+    used during the run on top of the memory already in use. On cuda devices the peak of the allocated memory is used,
+    otherwise the resident memory of the process is sampled while `fn` runs.
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        start_mem = torch.cuda.memory_allocated(device)
+        start = time.perf_counter()
+        out = fn(*args, **kwargs)
+        torch.cuda.synchronize(device)
+        elapsed = time.perf_counter() - start
+        return out, elapsed, torch.cuda.max_memory_allocated(device) - start_mem
+    start_mem, peak, done = _rss(), [0], threading.Event()
+    def _sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _rss())
+            time.sleep(0.005)
+    sampler = threading.Thread(target=_sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        out = fn(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return out, elapsed, max(peak[0], _rss()) - start_mem
+
+def benchmark_window(IM_class, msa_tokens, iters, windows, overlap=0, use_pdf=False, T=1, seed=0):
+    """
+    Compare the time and the peak memory of `IM_class.generate_all_msa` on `msa_tokens` for `iters` iterations
+    between the full-length generation and the windowed generation with each window size in `windows`
+    (and `overlap` columns shared by consecutive windows). All the runs start from the same random seed, and
+    the fraction of tokens that differ from the full-length result is also reported.
+    Returns a dictionary with one entry for the full-length generation (`None`) and one for each window size.
+    """
+    old_window, old_overlap = IM_class.window, IM_class.overlap
+    results = {}
+    try:
+        for window in [None] + list(windows):
+            IM_class.window, IM_class.overlap = window, overlap
+            torch.manual_seed(seed)
+            out, elapsed, memory = profile_run(IM_class.generate_all_msa, msa_tokens, iters, use_pdf=use_pdf, T=T)
+            out = DC(out)
+            if window is None:
+                full = out
+            results[window] = {"time": elapsed,
+                               "memory": memory,
+                               "diff_full": (out != full).to(torch.float64).mean().item()}
+            print(f"window={window}: {elapsed:.2f} s, {memory/2**20:.1f} MiB, "
+                  f"fraction of tokens different from full-length: {results[window]['diff_full']:.3f}")
+    finally:
+        IM_class.window, IM_class.overlap = old_window, old_overlap
+    return results
+
+def _site_frequencies(tokens, n_tokens):
+    # Frequencies (length, n_tokens) of the tokens in each column of the MSAs `tokens` (batch, rows, length+1)
+    tokens = tokens[..., 1:].to(torch.int64).reshape(-1, tokens.shape[-1] - 1)
+    return torch.nn.functional.one_hot(tokens, n_tokens).to(torch.float64).mean(dim=0)
+
+def benchmark_burn_in(IM_class, msa_tokens, iters, burn_ins, n_layers, use_pdf=True, T=1, seeds=(0, 1)):
+    """
+    Compare `IM_class.generate_all_msa` on `msa_tokens` for `iters` iterations between the full model and a burn-in
+    of each number of iterations in `burn_ins` done with the first `n_layers` layers (see `IM_class.burn_in_step`).
+    Each schedule is run once for each seed in `seeds`: the average wall-clock time is reported with the divergence of
+    the final MSAs from the ones of the full model (same seed), measured by the total variation distance between the
+    single-site frequencies (averaged over the columns), and the fraction of tokens different from `msa_tokens`.
+    The divergence between the full-model chains of different seeds (`freq_noise`) is the level expected by chance.
+    Returns a dictionary with one entry for each burn-in (0 is the full model).
+    """
+    old_burn_in, old_layers = IM_class.burn_in, IM_class.burn_in_layers
+    n_tokens = len(IM_class.msa_alphabet.all_toks)
+    tv = lambda f1, f2: 0.5 * (f1 - f2).abs().sum(dim=1).mean().item()
+    results = {}
+    try:
+        for burn_in in [0] + list(burn_ins):
+            IM_class.burn_in, IM_class.burn_in_layers = burn_in, n_layers
+            finals, elapsed = [], 0
+            for seed in seeds:
+                torch.manual_seed(seed)
+                out, t, _ = profile_run(IM_class.generate_all_msa, msa_tokens, iters, use_pdf=use_pdf, T=T)
+                finals.append(DC(out))
+                elapsed += t
+            freqs = [_site_frequencies(x, n_tokens) for x in finals]
+            if burn_in == 0:
+                full_time, full_freqs = elapsed, freqs
+                noise = [tv(f1, f2) for f1, f2 in zip(freqs[:-1], freqs[1:])]
+                freq_noise = float(np.mean(noise)) if noise else float("nan")
+            results[burn_in] = {"time": elapsed / len(seeds),
+                                "speedup": full_time / elapsed,
+                                "freq_divergence": float(np.mean([tv(f, g) for f, g in zip(freqs, full_freqs)])),
+                                "freq_noise": freq_noise,
+                                "diff_start": float(np.mean([(x != DC(msa_tokens)).to(torch.float64).mean().item()
+                                                             for x in finals]))}
+            print(f"burn_in={burn_in}" + (f" ({n_layers} layers)" if burn_in else " (full model)") + f": {results[burn_in]['time']:.2f} s, speedup {results[burn_in]['speedup']:.2f}, "
+                  f"divergence of the frequencies {results[burn_in]['freq_divergence']:.3f} (noise {freq_noise:.3f}), "
+                  f"fraction of tokens different from the start {results[burn_in]['diff_start']:.3f}")
+    finally:
+        IM_class.burn_in, IM_class.burn_in_layers = old_burn_in, old_layers
+    return results
+
+def benchmark_mask_schedule(IM_class, msa_tokens, iters, modes=("iid", "stratified", "permutation"), target=None,
+                            use_pdf=True, T=1, seeds=(0,)):
+    """
+    Compare the mask schedules `modes` (see `IM_class.mask_schedule`) on `IM_class.generate_all_msa` starting from
+    `msa_tokens` for `iters` iterations. For each mode it reports the fraction of tokens different from `msa_tokens`
+    after each iteration (averaged over the `seeds`), the number of iterations needed to reach the distance `target`
+    (by default the distance reached by the first mode after `iters` iterations, None if it is not reached) and the
+    number of iterations after which every entry has been masked at least once (None if some entries are never masked).
+    All the modes mask the entries at the same rate `IM_class.p_mask`, the measured rate (fraction of the entries
+    masked per iteration) is reported too. Returns a dictionary with one entry for each mode.
+    """
+    old_mode = IM_class.mask_mode
+    start = DC(msa_tokens).to(torch.int8)
+    eligible = (torch.as_tensor(IM_class.p_mask).to(DEVICE) > 0).expand(msa_tokens.shape).reshape(-1)
+    first_reached = lambda x: int(np.argmax(x)) + 1 if np.any(x) else None
+    results = {}
+    try:
+        for mode in modes:
+            IM_class.mask_mode = mode
+            curves, elapsed = [], 0
+            for seed in seeds:
+                torch.manual_seed(seed)
+                out, t, _ = profile_run(IM_class.generate_all_msa, msa_tokens, iters, use_pdf=use_pdf, T=T, save_all=True)
+                curves.append((out[1:] != start).flatten(1).to(torch.float64).mean(dim=1))
+                elapsed += t
+            distance = torch.stack(curves).mean(dim=0).numpy()
+            if target is None:
+                target = distance[-1]
+            masks = IM_class.mask_schedule(msa_tokens.shape, iters, mode).flatten(1)
+            covered = (torch.cumsum((masks | ~eligible).to(torch.int32), dim=0) > 0).all(dim=1).cpu().numpy()
+            results[mode] = {"time": elapsed / len(seeds),
+                             "mask_rate": masks.to(torch.float64).mean().item(),
+                             "distance": distance,
+                             "iters_to_target": first_reached(distance >= target),
+                             "iters_full_coverage": first_reached(covered)}
+            print(f"{mode}: masking rate {results[mode]['mask_rate']:.3f}, "
+                  f"distance from the start {distance[-1]:.3f} after {iters} iterations, "
+                  f"{results[mode]['iters_to_target']} iterations to reach {target:.3f}, "
+                  f"every entry masked after {results[mode]['iters_full_coverage']} iterations ({results[mode]['time']:.2f} s)")
+    finally:
+        IM_class.mask_mode = old_mode
+    return results
+
+def benchmark_scoring(IM_class, sequences, context, positions_per_pass=[1], batch_size=32):
+    """
+    Throughput (sequences per second) of `IM_class.score_sequences` on `sequences` with the context MSA `context`, for each
+    number of positions masked per forward pass in `positions_per_pass`. The mean absolute difference between the
+    pseudo-log-likelihoods and the ones obtained with the first value of `positions_per_pass` is also reported.
+    """
+    results = {}
+    for k in positions_per_pass:
+        scores, elapsed, memory = profile_run(IM_class.score_sequences, sequences, context,
+                                              positions_per_pass=k, batch_size=batch_size)
+        if not results:
+            ref = scores
+        results[k] = {"time": elapsed,
+                      "memory": memory,
+                      "seqs_per_s": len(scores) / elapsed,
+                      "diff_ref": float(np.mean(np.abs(scores - ref)))}
+        print(f"positions_per_pass={k} (context of {np.shape(context)[1]} sequences): {results[k]['seqs_per_s']:.2f} seqs/s, "
+              f"{memory/2**20:.1f} MiB, mean abs difference of the scores: {results[k]['diff_ref']:.3f}")
+    return results
+
+def token_memory(IM_class):
+    """
+    Memory (in bytes) used by the tokens kept in `IM_class`: the full MSA `msa_data` (0 if it is in a `TokenStore`,
+    whose rows are read from the disk when needed) and the batch `msa_batch_tokens`.
+    """
+    msa_data = 0 if isinstance(IM_class.msa_data, TokenStore) else IM_class.msa_data.nbytes
+    results = {"msa_data": msa_data, "msa_batch_tokens": IM_class.msa_batch_tokens.nbytes}
+    print(f"msa_data: {msa_data/2**20:.1f} MiB ({IM_class.msa_data.shape[1]} sequences), "
+          f"msa_batch_tokens: {results['msa_batch_tokens']/2**20:.1f} MiB ({IM_class.msa_batch_tokens.dtype})")
+    return results
+
+# %% ../00_core.ipynb 19
 import os
 import pickle
+import shutil
 from fastcore.script import *
 
 @call_parse
@@ -706,10 +1378,20 @@ def gen_MSAs(filepath:Param(help='Path of the input directory',type=str,default=
          pmask:Param(help='Masking probability',type=float,default=0.1),
          num:Param(help='Size of the batches MSAs which the MSA-Transformer receives as input',type=int,nargs='+',default=100),
          depth:Param(help='Number of batches (of size num) that you want to generate',type=int,default=2),
-         generate:Param(help='How should I generate sequences ? False (=Batch generation) or Linear with context (=linear-ran/linear-tot-ran), `-ran` means that the context MSA is sampled randomly (once) while `-tot-ran` means that it is sampled randomly each time.',type=str, default=False),
+         generate:Param(help='How should I generate sequences ? False (=Batch generation) or Linear with context (=linear-ran/linear-tot-ran/linear-knn/linear-strat), `-ran` means that the context MSA is sampled randomly (once) while `-tot-ran` means that it is sampled randomly each time, `-knn` uses the sequences closest to each ancestor and `-strat` samples them each time from groups of increasing distance from the ancestor.',type=str, default=False),
          print_all:Param(help='Should I print the MSA after each iteration ? (bool)',type=bool_arg,default=False),
          range_vals:Param(help='First and last index of the sequences that you want to use as ancestors', type=int,nargs='+',default=False),
-         phylo_w:Param(help='Should I sample the starting sequences from the phylogeny weights ? (bool)',type=bool_arg,default=False)
+         phylo_w:Param(help='Should I sample the starting sequences from the phylogeny weights ? (bool)',type=bool_arg,default=False),
+         window:Param(help='Number of columns given to the model at once (generation with overlapping windows), if 0 it uses the full length',type=int,default=0),
+         overlap:Param(help='Number of columns shared by two consecutive windows (only when `window` > 0)',type=int,default=0),
+         token_store:Param(help='Directory where the tokenized MSA is saved (once) as a memory-mapped store, if False the full MSA is loaded in memory',type=str,default=False),
+         collect:Param(help='Should I also save the contact maps and the (column-averaged) embeddings computed while generating ? (bool)',type=bool_arg,default=False),
+         weights:Param(help='Directory of the memory-mapped weights of the model (see `convert_weights`), if False the ESM checkpoint is loaded',type=str,default=False),
+         seed:Param(help='Seed used to select the ancestors and the context (must be the same for all the shards of `range_vals`)',type=int,default=0),
+         burn_in:Param(help='Number of first iterations done with a cheaper model (see `burn_in_layers` and `burn_in_context`)',type=int,default=0),
+         burn_in_layers:Param(help='Number of layers of the model used during the burn-in, if 0 it uses all of them',type=int,default=0),
+         burn_in_context:Param(help='Number of context sequences used during the burn-in (only for Linear generation), if 0 it uses all of them',type=int,default=0),
+         mask_mode:Param(help='How the masks are drawn: iid (independently at each iteration), stratified (each token masked once per 1/pmask iterations) or permutation (every 1/pmask iterations with a random phase)',type=str,default='iid')
          ):
     "Generate a new MSA either with Batch generation of Context generation. It shuffles the initial MSA and uses different slices as batch MSAs"
 
@@ -727,15 +1409,25 @@ def gen_MSAs(filepath:Param(help='Path of the input directory',type=str,default=
 
     # Save Input MSA
     print('Tokenize')
-    Class = IM_MSA_Transformer(filename=filename,
-                               num=[-1],
-                               filepath=filepath)
-    idx_list = Class.idx_list
-    old_tkn = Class.print_tokens()
+    if token_store is False:
+        token_store = None
+        Class = IM_MSA_Transformer(filename=filename,
+                                   num=[-1],
+                                   filepath=filepath,
+                                   weights=weights or None)
+        idx_list = Class.idx_list
+        old_tkn = Class.print_tokens()
+        np.save(path1 + "/original-tokens.npy", old_tkn[0])
+        del Class, old_tkn
+    else:
+        alphabet = esm.Alphabet.from_architecture("msa_transformer")
+        idx_list = alphabet.tok_to_idx
+        store = TokenStore.open(filepath + '/' + filename[0], token_store, alphabet)
+        shutil.copyfile(store.path, path1 + "/original-tokens.npy")
+        del store
     a_file = open(path1 + "/dictionary-tokens.pkl", "wb")
     pickle.dump(idx_list, a_file)
     a_file.close()
-    np.save(path1 + "/original-tokens.npy", old_tkn[0])
 
     add_strs = ""
     if pdf==True:
@@ -751,13 +1443,27 @@ def gen_MSAs(filepath:Param(help='Path of the input directory',type=str,default=
         add_strs += "_"+generate+"_(context-"+str(num[0])+")"
     if phylo_w:
         add_strs += "_phylo-w"
+    if window > 0:
+        add_strs += f"_window-{window}-{overlap}"
+    if burn_in > 0:
+        add_strs += f"_burn-in-{burn_in}-{burn_in_layers}-{burn_in_context}"
+    if mask_mode != "iid":
+        add_strs += f"_mask-{mask_mode}"
 
     print('Generate Class')
     Class = IM_MSA_Transformer(iterations=np.array([Iters]),
                                p_mask=pmask,
                                filename=filename,
                                num=num,
-                               filepath=filepath)
+                               filepath=filepath,
+                               window=window if window > 0 else None,
+                               overlap=overlap,
+                               token_store=token_store,
+                               weights=weights or None,
+                               burn_in=burn_in,
+                               burn_in_layers=burn_in_layers or None,
+                               burn_in_context=burn_in_context or None,
+                               mask_mode=mask_mode)
 
     print('Compute results from Class')
     Class.iterations = np.array([Iters])
@@ -765,16 +1471,17 @@ def gen_MSAs(filepath:Param(help='Path of the input directory',type=str,default=
 
     if generate == False:
         print('Generating MSA with same size as the original one')
-        old_T, new_T = Class.Batch_MSA(simplified=True,
-                                    repetitions=depth,
-                                    use_pdf=pdf, sample_all=sample_all, T=T, phylo=phylo_w)
+        out = Class.Batch_MSA(simplified=True,
+                              repetitions=depth,
+                              use_pdf=pdf, sample_all=sample_all, T=T, phylo=phylo_w, collect=collect)
+        old_T, new_T = out[:2]
         NNN = min(num[0] * depth, old_T.shape[1])
 
-    elif generate=='linear-ran' or generate=='linear-tot-ran':
+    elif generate in ('linear-ran', 'linear-tot-ran', 'linear-knn', 'linear-strat'):
         print('Generate MSA with linear context generation')
-        orig_tkn = np.load(path + "/" + path1 + "/original-tokens.npy")
+        orig_tkn = np.load(path + "/" + path1 + "/original-tokens.npy", mmap_mode="r")
         # select ancestor and context
-        np.random.seed(0)
+        np.random.seed(seed)
         indices = np.random.permutation(orig_tkn.shape[0])
         indexes_context = indices[:num[0]]
         indices = np.random.permutation(orig_tkn.shape[0])
@@ -790,12 +1497,17 @@ def gen_MSAs(filepath:Param(help='Path of the input directory',type=str,default=
                 ind_ancestor = indices[range_vals[0]:range_vals[1]]
         ancestor = orig_tkn[ind_ancestor,:]
         context  = orig_tkn[indexes_context,:][None,:,:]
-        if generate=='linear-tot-ran':
-            context = 'tot-ran'
-        old_T, new_T = Class.Context_MSA(None, ancestor, context, use_pdf=pdf, simplified=True, sample_all=sample_all, print_all=print_all, T=T)
-        if generate=='linear-tot-ran':
+        if generate!='linear-ran':
+            context = generate[len('linear-'):]
+        out = Class.Context_MSA(None, ancestor, context, use_pdf=pdf, simplified=True, sample_all=sample_all, print_all=print_all, T=T,
+                                collect=collect)
+        old_T, new_T = out[:2]
+        if generate!='linear-ran':
             old_T = ancestor[None,:,:]
         NNN = new_T.shape[2]
+        if range_vals is not False:
+            # All the shards of `range_vals` are saved in the same directory (see `merge_shards`)
+            NNN = len(indices)
     else:
         print('ERROR: Select a generative process')
 
@@ -812,13 +1524,33 @@ def gen_MSAs(filepath:Param(help='Path of the input directory',type=str,default=
               path1 + "/" + path2))
 
     # Save data
-    if generate == False or generate=='linear-tot-ran':
-        np.save(path1 + "/" + path2 + "/shuffled-tokens.npy", old_T[0])
-    else:
-        np.save(path1 + "/" + path2 + "/context-tokens.npy", old_T[0])
     str_add = ''
     if range_vals is not False:
         str_add = '_range_indx_'+str(range_vals[0])+','+str(range_vals[1])
+    if generate == False:
+        np.save(path1 + "/" + path2 + "/shuffled-tokens.npy", old_T[0])
+    elif generate in ('linear-tot-ran', 'linear-knn', 'linear-strat'):
+        # The ancestors of each shard are saved with its `range_vals` (merged by `merge_shards`)
+        np.save(path1 + "/" + path2 + "/shuffled-tokens"+str_add+".npy", old_T[0])
+    else:
+        np.save(path1 + "/" + path2 + "/context-tokens.npy", old_T[0])
     np.save(path1 + "/" + path2 + "/new-tokens"+str_add+".npy", new_T[0])
+    if collect:
+        np.save(path1 + "/" + path2 + "/contacts"+str_add+".npy", out[2][0])
+        np.save(path1 + "/" + path2 + "/embeddings"+str_add+".npy", out[3][0])
+    if generate in ('linear-ran', 'linear-tot-ran', 'linear-knn', 'linear-strat'):
+        # Manifest used to check and merge the shards of `range_vals` (see `merge_shards`)
+        outputs = {"new-tokens": new_T[0]}
+        if collect:
+            outputs.update({"contacts": out[2][0], "embeddings": out[3][0]})
+        if generate != 'linear-ran':
+            outputs["shuffled-tokens"] = old_T[0]
+        params = dict(filename=filename, Iters=Iters, pmask=pmask, num=num, depth=depth, generate=generate, pdf=pdf, T=T,
+                      sample_all=sample_all, print_all=print_all, window=window, overlap=overlap, seed=seed,
+                      burn_in=burn_in, burn_in_layers=burn_in_layers, burn_in_context=burn_in_context,
+                      mask_mode=mask_mode)
+        write_manifest(path1 + "/" + path2, str_add, params, orig_tkn, indices,
+                       orig_tkn[indexes_context] if generate == 'linear-ran' else generate, range_vals, len(indices), outputs,
+                       {"shuffled-tokens": 0})
 
     return 1
@@ -0,0 +1,152 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../05_dataset.ipynb.
+
+# %% auto 0
+__all__ = ['GeneratedMSAs']
+
+# %% ../05_dataset.ipynb 3
+import time
+import queue
+import threading
+from collections import deque
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .store import TokenStore
+
+# Dataset of MSAs generated on the fly
+class GeneratedMSAs(IterableDataset):
+    """
+    Iterable dataset of MSAs generated by `model` (an `IM_MSA_Transformer`) from the sequences of `family` (a
+    `TokenStore` or a tokens tensor of shape (1, depth, length), by default the MSA of `model`). Each item is a batch
+    of `batch_size` MSAs (int8 tokens of shape (`batch_size`, `num`, length)) generated together: `num` sequences
+    are sampled from `family` and masked iteratively `iters` times with probability `p_mask` (sampling at temperature
+    `T` if `use_pdf`).
+
+    `context`:      None (the whole MSA is masked), a 2d array of tokens (fixed context), "ran" (`context_num`
+                    sequences sampled once for each MSA) or "tot-ran" (sampled at each iteration), as in `GenerationServer`.
+
+    `prefetch`:     number of batches generated ahead by the background thread.
+
+    `replay_size`:  number of served batches kept in the replay buffer (0 = no replay, the training loop waits for
+                    each new batch). When no new batch is ready after `wait` seconds a batch of the buffer is served
+                    instead, and a fraction `replay_ratio` of the batches is taken from the buffer in any case.
+
+    `n_batches`:    number of batches of an epoch (None = infinite).
+
+    Use it with `DataLoader(dataset, batch_size=None)` and `num_workers=0`: the model is used by the background thread
+    of the main process. The tokens are int8, they must be converted to int64 before being given to a model.
+    """
+    def __init__(self, model, family=None, num=100, iters=10, p_mask=0.1, T=1, use_pdf=False, rand_perm=False,
+                 context=None, context_num=100, batch_size=1, n_batches=None, prefetch=2, replay_size=0,
+                 replay_ratio=0., wait=0., seed=0):
+        self.model = model
+        self.family = model.msa_data if family is None else family
+        if context is not None and not isinstance(context, str):
+            context = torch.as_tensor(np.asarray(context), dtype=torch.int8)
+            if context.dim() == 2:
+                context = context[None, :, :]
+            if context.shape[2] != self.family.shape[2]:
+                raise ValueError("The context and the family must have the same length")
+        elif context not in (None, "ran", "tot-ran"):
+            raise ValueError(f"Unknown context mode {context}")
+        if prefetch < 1:
+            raise ValueError("`prefetch` must be at least 1")
+        self.num, self.iters, self.p_mask, self.T = min(num, self.family.shape[1]), iters, p_mask, T
+        self.use_pdf, self.rand_perm = use_pdf, rand_perm
+        self.context, self.context_num = context, min(context_num, self.family.shape[1])
+        self.batch_size, self.n_batches, self.prefetch = batch_size, n_batches, prefetch
+        self.replay = deque(maxlen=replay_size) if replay_size > 0 else None
+        self.replay_ratio, self.wait = replay_ratio, wait
+        self.seed, self.epoch = seed, 0
+        self.stats = {"generated": 0, "fresh": 0, "replayed": 0, "wait_time": 0.}
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _sample(self, rng, num):
+        inds = torch.from_numpy(rng.permutation(self.family.shape[1])[:num])
+        if isinstance(self.family, TokenStore):
+            return self.family.gather(inds)
+        return self.family[:, inds, :].to(torch.int8)
+
+    def generate_batch(self, rng=None):
+        """
+        Generate one batch of MSAs (int8 tensor of shape (`batch_size`, `num`, length)), see `GeneratedMSAs`. The
+        sequences are sampled with the numpy generator `rng`, the masks and the new tokens with the torch generator.
+        """
+        if rng is None:
+            rng = np.random.default_rng(self.seed)
+        model = self.model
+        tokens = torch.cat([self._sample(rng, self.num) for _ in range(self.batch_size)], dim=0)
+        context = None
+        if self.context == "ran":
+            context = torch.cat([self._sample(rng, self.context_num) for _ in range(self.batch_size)], dim=0)
+        elif isinstance(self.context, torch.Tensor):
+            context = self.context.expand(self.batch_size, -1, -1)
+        model.p_mask = self.p_mask
+        with torch.no_grad():
+            for i in range(self.iters):
+                if self.context == "tot-ran":
+                    context = torch.cat([self._sample(rng, self.context_num) for _ in range(self.batch_size)], dim=0)
+                if context is None:
+                    tokens = model.generate_MSA(tokens, mask_idx=model.msa_alphabet.mask_idx, use_pdf=self.use_pdf,
+                                                sample_all=False, T=self.T, rand_perm=self.rand_perm)
+                else:
+                    tokens = model.generate_MSA_context(tokens, context, mask_idx=model.msa_alphabet.mask_idx,
+                                                        use_pdf=self.use_pdf, sample_all=False, T=self.T,
+                                                        rand_perm=self.rand_perm)
+        return tokens.to("cpu", torch.int8)
+
+    def _produce(self, batches, stop, rng):
+        # Generate batches until `stop` is set, an error is passed to the training loop and ends the generation
+        while not stop.is_set():
+            try:
+                item = self.generate_batch(rng)
+                self.stats["generated"] += 1
+            except Exception as e:
+                item = e
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if isinstance(item, Exception):
+                return
+
+    def _next(self, batches, rng):
+        if self.replay and rng.random() < self.replay_ratio:
+            self.stats["replayed"] += 1
+            return self.replay[rng.integers(len(self.replay))]
+        start = time.perf_counter()
+        try:
+            item = batches.get(timeout=self.wait) if self.replay else batches.get()
+        except queue.Empty:
+            self.stats["replayed"] += 1
+            return self.replay[rng.integers(len(self.replay))]
+        finally:
+            self.stats["wait_time"] += time.perf_counter() - start
+        if isinstance(item, Exception):
+            raise item
+        self.stats["fresh"] += 1
+        if self.replay is not None:
+            self.replay.append(item)
+        return item
+
+    def __iter__(self):
+        # Each epoch (and each worker of a `DataLoader`) samples different sequences
+        worker = get_worker_info()
+        seed = [self.seed, self.epoch, 0 if worker is None else worker.id]
+        self.epoch += 1
+        rng = np.random.default_rng(seed + [0])
+        batches, stop = queue.Queue(maxsize=self.prefetch), threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop, np.random.default_rng(seed + [1])),
+                                    daemon=True)
+        producer.start()
+        try:
+            n = 0
+            while self.n_batches is None or n < self.n_batches:
+                yield self._next(batches, rng)
+                n += 1
+        finally:
+            stop.set()
+            producer.join()
@@ -0,0 +1,397 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../02_serve.ipynb.
+
+# %% auto 0
+__all__ = ['GenerationServer', 'GenerationClient', 'StandInModel', 'serve_MSAs']
+
+# %% ../02_serve.ipynb 3
+import os
+import json
+import time
+import threading
+import itertools
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib import request as urlrequest
+import numpy as np
+import torch
+from fastcore.script import *
+
+from .core import IM_MSA_Transformer, estimate_memory
+from .store import TokenStore
+
+class _Request:
+    "A generation request waiting in the queue of `GenerationServer`"
+    _ids = itertools.count()
+
+    def __init__(self, key, tokens, params, context=None, family=None, memory=0):
+        self.id = next(self._ids)
+        self.key = key              # requests with the same key can be stacked along the batch axis
+        self.tokens = tokens        # (1, rows, length) tokens to be masked iteratively
+        self.params = params
+        self.context = context      # (1, context rows, length) fixed context MSA (or None)
+        self.family = family        # TokenStore / tensor from which the context is sampled (`ran` / `tot-ran`)
+        self.memory = memory
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.done = threading.Event()
+        self.result, self.error = None, None
+
+# Service that batches the generation requests
+class GenerationServer:
+    """
+    Keep the `models` (dictionary name -> `IM_MSA_Transformer`) and the `families` (dictionary name -> `TokenStore`
+    or tokens tensor of shape (1, depth, length)) in memory and serve generation requests.
+    Requests are queued and a single worker stacks compatible requests (same model, parameters and shapes) along the
+    batch axis, waiting at most `max_wait` seconds for other requests to arrive. A batch contains at most `max_batch`
+    requests and its estimated memory (see `estimate_memory`) must fit in `memory_budget` bytes, requests that don't
+    fit alone are rejected, as well as new requests when `max_queue` requests are already waiting.
+    """
+    def __init__(self, models, families=None, max_batch=16, max_wait=0.01, memory_budget=8*2**30, max_queue=1024,
+                 embed_dim=768, heads=12):
+        if isinstance(models, dict):
+            self.models = models
+        else:
+            self.models = {"default": models}
+        self.default_model = next(iter(self.models))
+        self.families = {} if families is None else families
+        self.max_batch, self.max_wait = max_batch, max_wait
+        self.memory_budget, self.max_queue = memory_budget, max_queue
+        self.embed_dim, self.heads = embed_dim, heads
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.stats = {"requests": 0, "rejected": 0, "failed": 0, "batches": 0, "batched_requests": 0}
+        self.latencies, self.waits = deque(maxlen=1000), deque(maxlen=1000)
+        self._stop = False
+        self._worker = None
+        self._httpd = None
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _rows(self, family, inds):
+        if isinstance(family, TokenStore):
+            return family.gather(inds)
+        return family[:, inds, :]
+
+    def _sample(self, family, num):
+        return self._rows(family, torch.randperm(family.shape[1])[:num])
+
+    def _tokens(self, value):
+        tokens = torch.as_tensor(np.asarray(value), dtype=torch.int8)
+        if tokens.dim() == 2:
+            tokens = tokens[None, :, :]
+        if tokens.dim() != 3 or tokens.shape[0] != 1:
+            raise ValueError("tokens must be given as a 2d array (rows x length)")
+        return tokens
+
+    def make_request(self, req):
+        """
+        Convert the dictionary `req` into a queued request. Fields of `req`:
+
+        `tokens` or (`family`, `num`): starting tokens (rows x length), or `num` sequences sampled from `family`.
+
+        `p_mask`, `T`, `use_pdf`, `iters`, `rand_perm`: generation parameters (default 0.1, 1, False, 10, False).
+
+        `context`: None (generate the full MSA), a 2d array of tokens (fixed context), "ran" (context sampled once
+                   from `context_family`) or "tot-ran" (context sampled at each iteration from `context_family`).
+
+        `context_num`: depth of the sampled context (default 100), `context_family`: default is `family`.
+
+        `model`: name of the model (default is the first model).
+        """
+        model = req.get("model", self.default_model)
+        if model not in self.models:
+            raise ValueError(f"Unknown model {model}")
+        params = {"p_mask": float(req.get("p_mask", 0.1)),
+                  "T": float(req.get("T", 1)),
+                  "use_pdf": bool(req.get("use_pdf", False)),
+                  "iters": int(req.get("iters", 10)),
+                  "rand_perm": bool(req.get("rand_perm", False))}
+        if req.get("tokens") is not None:
+            tokens = self._tokens(req["tokens"])
+        elif req.get("family") in self.families:
+            tokens = self._sample(self.families[req["family"]], int(req.get("num", 1)))
+        else:
+            raise ValueError("Either `tokens` or a known `family` must be given")
+        mode, context, family, ctx_rows = req.get("context"), None, None, 0
+        if mode in ("ran", "tot-ran"):
+            family_name = req.get("context_family", req.get("family"))
+            if family_name not in self.families:
+                raise ValueError("A known `context_family` (or `family`) must be given to sample the context")
+            family = self.families[family_name]
+            if family.shape[2] != tokens.shape[2]:
+                raise ValueError("The context family and the tokens must have the same length")
+            ctx_rows = min(int(req.get("context_num", 100)), family.shape[1])
+            if mode == "ran":
+                context = self._sample(family, ctx_rows)
+                family = None
+        elif mode is not None:
+            context, mode = self._tokens(mode), "fixed"
+            ctx_rows = context.shape[1]
+        if context is not None and context.shape[2] != tokens.shape[2]:
+            raise ValueError("The context and the tokens must have the same length")
+        key = (model, mode is not None, mode == "tot-ran", tokens.shape[1], ctx_rows, tokens.shape[2]) + tuple(sorted(params.items()))
+        memory = estimate_memory(tokens.shape[1] + ctx_rows, tokens.shape[2], self.embed_dim, self.heads)
+        return _Request(key, tokens, params, context=context, family=family, memory=memory)
+
+    def submit(self, req):
+        """ Queue the request `req` (a dictionary, see `self.make_request`) and return it without waiting for the result. """
+        request = self.make_request(req)
+        with self.cond:
+            if request.memory > self.memory_budget:
+                self.stats["rejected"] += 1
+                raise MemoryError(f"The request needs ~{request.memory/2**20:.0f} MiB, more than the memory budget")
+            if len(self.queue) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise RuntimeError("The queue is full")
+            self.queue.append(request)
+            self.cond.notify()
+        return request
+
+    def generate(self, req, timeout=None):
+        """ Queue the request `req` and wait for the generated tokens (numpy array of shape (rows, length)). """
+        request = self.submit(req)
+        if not request.done.wait(timeout):
+            raise TimeoutError("The request was not served in time")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _next_batch(self):
+        # Take the oldest request and all the compatible ones (in order of arrival) that fit in the memory budget
+        with self.cond:
+            while not self.queue and not self._stop:
+                self.cond.wait()
+            if self._stop:
+                return []
+            first = self.queue[0]
+            deadline = first.submitted + self.max_wait
+            while not self._stop and time.perf_counter() < deadline and len(self.queue) < self.max_batch:
+                self.cond.wait(deadline - time.perf_counter())
+            batch, memory = [], 0
+            for request in list(self.queue):
+                if len(batch) == self.max_batch:
+                    break
+                if request.key == first.key and memory + request.memory <= self.memory_budget:
+                    batch.append(request)
+                    memory += request.memory
+            for request in batch:
+                self.queue.remove(request)
+            return batch
+
+    def _run_batch(self, batch):
+        # Stack the requests along the batch axis and iterate the masking on all of them at once
+        model = self.models[batch[0].key[0]]
+        params = batch[0].params
+        tokens = torch.cat([r.tokens for r in batch], dim=0)
+        context = None
+        if batch[0].context is not None:
+            context = torch.cat([r.context for r in batch], dim=0)
+        model.p_mask = params["p_mask"]
+        for i in range(params["iters"]):
+            if batch[0].family is not None:
+                context = torch.cat([self._sample(r.family, r.key[4]) for r in batch], dim=0)
+            if context is None:
+                tokens = model.generate_MSA(tokens, mask_idx=model.msa_alphabet.mask_idx, use_pdf=params["use_pdf"],
+                                            sample_all=False, T=params["T"], rand_perm=params["rand_perm"])
+            else:
+                tokens = model.generate_MSA_context(tokens, context, mask_idx=model.msa_alphabet.mask_idx,
+                                                    use_pdf=params["use_pdf"], sample_all=False, T=params["T"],
+                                                    rand_perm=params["rand_perm"])
+        return tokens.cpu().numpy()
+
+    def _loop(self):
+        while not self._stop:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            for request in batch:
+                request.started = start
+            try:
+                with torch.no_grad():
+                    tokens = self._run_batch(batch)
+                for request, result in zip(batch, tokens):
+                    request.result = result
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].error = e
+                else:
+                    # Retry the requests one at a time, so that only the faulty ones fail
+                    for request in batch:
+                        try:
+                            with torch.no_grad():
+                                request.result = self._run_batch([request])[0]
+                        except Exception as e:
+                            request.error = e
+            end = time.perf_counter()
+            with self.cond:
+                self.stats["requests"] += len(batch)
+                self.stats["failed"] += sum(request.error is not None for request in batch)
+                self.stats["batches"] += 1
+                self.stats["batched_requests"] += len(batch) - 1
+                for request in batch:
+                    self.waits.append(request.started - request.submitted)
+                    self.latencies.append(end - request.submitted)
+            for request in batch:
+                request.done.set()
+
+    def metrics(self):
+        """ Queue depth, number of served/rejected requests, mean batch size and latencies (seconds) of the last requests. """
+        with self.cond:
+            out = dict(self.stats)
+            out["queue_depth"] = len(self.queue)
+            latencies, waits = list(self.latencies), list(self.waits)
+        out["mean_batch_size"] = out["requests"] / max(out["batches"], 1)
+        for name, values in (("latency", latencies), ("queue_wait", waits)):
+            if values:
+                out[name] = {"mean": float(np.mean(values)), "p50": float(np.percentile(values, 50)),
+                             "p95": float(np.percentile(values, 95)), "max": float(np.max(values))}
+        return out
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def start(self, host="127.0.0.1", port=None):
+        """
+        Start the worker thread and, if `port` is not None, an HTTP server on `host`:`port` (0 picks a free port) with the
+        endpoints `POST /generate` (body: the request as JSON, answer: `{"tokens": ...}`), `GET /metrics` and `GET /health`.
+        """
+        self._stop = False
+        self._worker = threading.Thread(target=self._loop, daemon=True)
+        self._worker.start()
+        if port is not None:
+            self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+            threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+            print(f"Generation server listening on http://{host}:{self._httpd.server_address[1]}")
+        return self
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        """ Stop the HTTP server and the worker (the requests still in the queue are dropped). """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        with self.cond:
+            self._stop = True
+            self.cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._send(200, server.metrics())
+            elif self.path == "/health":
+                self._send(200, {"status": "ok", "models": list(server.models), "families": list(server.families)})
+            else:
+                self._send(404, {"error": "unknown endpoint"})
+
+        def do_POST(self):
+            if self.path != "/generate":
+                return self._send(404, {"error": "unknown endpoint"})
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                tokens = server.generate(req)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": str(e)})
+            except (MemoryError, RuntimeError) as e:
+                return self._send(503, {"error": str(e)})
+            except Exception as e:
+                return self._send(500, {"error": repr(e)})
+            self._send(200, {"tokens": tokens.tolist()})
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+# Client for the HTTP service
+class GenerationClient:
+    """ Send generation requests to a `GenerationServer` running at `url` (e.g. `http://127.0.0.1:8000`). """
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def _call(self, path, data=None, timeout=None):
+        if data is not None:
+            data = json.dumps(data).encode()
+        req = urlrequest.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urlrequest.urlopen(req, timeout=timeout) as f:
+            return json.loads(f.read())
+
+    def generate(self, timeout=None, **req):
+        """ Generate new tokens with the parameters `req` (see `GenerationServer.make_request`), returns an array (rows x length). """
+        out = self._call("/generate", req, timeout)
+        return np.array(out["tokens"], dtype=np.int8)
+
+    def metrics(self):
+        return self._call("/metrics")
+
+# Model used to test the service without MSA Transformer
+class StandInModel:
+    """
+    Stand-in for `IM_MSA_Transformer` that can be given to `GenerationServer` to test it offline: it masks the tokens with
+    probability `p_mask` and replaces the masked ones with random amino-acid tokens, waiting `delay` seconds per call
+    (to mimic the time of a forward pass).
+    """
+    def __init__(self, p_mask=0.1, delay=0.):
+        self.p_mask, self.delay = p_mask, delay
+        self.msa_alphabet = type("Alphabet", (), {"mask_idx": 32})()
+        self.calls = 0
+
+    def generate_MSA(self, MSA_tokens, mask_idx=32, use_pdf=False, sample_all=False, T=1, rand_perm=False):
+        self.calls += 1
+        time.sleep(self.delay)
+        mask = torch.rand(MSA_tokens.shape) < self.p_mask
+        mask[:, :, 0] = False
+        new = torch.randint(4, 24, MSA_tokens.shape, dtype=MSA_tokens.dtype)
+        return torch.where(mask, new, MSA_tokens)
+
+    def generate_MSA_context(self, ancestor, context, mask_idx=32, use_pdf=False, sample_all=False, T=1, rand_perm=False):
+        if context.shape[0] != ancestor.shape[0] or context.shape[2] != ancestor.shape[2]:
+            raise ValueError("The context and the ancestors must have the same batch size and length")
+        return self.generate_MSA(ancestor, mask_idx, use_pdf, sample_all, T, rand_perm)
+
+
+# %% ../02_serve.ipynb 12
+@call_parse
+def serve_MSAs(filepath:Param(help='Path of the input directory',type=str,default='./'),
+               filename:Param(help='Name of the MSA file(s) of the families that can be used in the requests',type=str,nargs='+',default=False),
+               token_store:Param(help='Directory of the memory-mapped token stores of the families',type=str,default='token_stores'),
+               pretrained_model_path:Param(help='Path(s) of fine-tuned models (state dicts or `WeightStore` directories) to load in addition to the original one',type=str,nargs='+',default=False),
+               weights:Param(help='Directory of the memory-mapped weights of the original model (see `convert_weights`)',type=str,default=False),
+               host:Param(help='Host of the HTTP server',type=str,default='127.0.0.1'),
+               port:Param(help='Port of the HTTP server',type=int,default=8000),
+               max_batch:Param(help='Maximum number of requests in a batch',type=int,default=16),
+               max_wait:Param(help='Maximum time (s) waited to fill a batch',type=float,default=0.01),
+               memory_budget:Param(help='Memory budget of a batch (GiB)',type=float,default=8)
+               ):
+    "Start a local generation service that keeps MSA Transformer in memory and batches the requests of many clients"
+    models = {"default": IM_MSA_Transformer(filename=filename[:1], num=[1], filepath=filepath, token_store=token_store,
+                                            weights=weights or None)}
+    for path in (pretrained_model_path or []):
+        if os.path.isdir(path):
+            models[path] = IM_MSA_Transformer(filename=filename[:1], num=[1], filepath=filepath, token_store=token_store,
+                                              weights=path)
+        else:
+            models[path] = IM_MSA_Transformer(filename=filename[:1], num=[1], filepath=filepath, token_store=token_store,
+                                              pretrained_model_path=path, weights=weights or None)
+    alphabet = models["default"].msa_alphabet
+    families = {ff.rsplit('.', 1)[0]: TokenStore.open(filepath + '/' + ff, token_store, alphabet) for ff in filename}
+    server = GenerationServer(models, families, max_batch=max_batch, max_wait=max_wait,
+                              memory_budget=int(memory_budget * 2**30)).start(host, port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,159 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../04_shards.ipynb.
+
+# %% auto 0
+__all__ = ['array_hash', 'write_manifest', 'load_shards', 'plan_shards', 'merge_shards', 'plan_MSAs', 'merge_MSAs']
+
+# %% ../04_shards.ipynb 3
+import os
+import json
+import glob
+import hashlib
+import numpy as np
+from fastcore.script import *
+
+def array_hash(x):
+    """ Short hash (sha1) of the content of the array `x` (or of the string `x`). """
+    if isinstance(x, str):
+        return hashlib.sha1(x.encode()).hexdigest()
+    return hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest()
+
+def write_manifest(directory, str_add, params, original_tokens, ancestors, context, range_vals, n_ancestors, outputs,
+                   axes=None):
+    """
+    Save the manifest of the outputs `outputs` (dictionary name -> array) of a run of `gen_MSAs` in `directory`
+    (`new-tokens` + `str_add` + `.json`). `ancestors` is the order of the sequences from which the ancestors of
+    `range_vals` are taken and `context` the context MSA (or the name of the context mode). `axes` gives the ancestors
+    axis of the outputs (dictionary name -> axis, 1 for the outputs that are not in it).
+    """
+    axes = {} if axes is None else axes
+    manifest = {"params": params,
+                "original_tokens": array_hash(original_tokens),
+                "ancestors": array_hash(ancestors),
+                "context": array_hash(context),
+                "range": [int(range_vals[0]), int(range_vals[1])] if range_vals is not False else None,
+                "n_ancestors": int(n_ancestors),
+                "outputs": {name: list(np.shape(x)) for name, x in outputs.items()},
+                "axes": {name: int(axes.get(name, 1)) for name in outputs}}
+    with open(os.path.join(directory, "new-tokens" + str_add + ".json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _axis(manifest, name):
+    # Ancestors axis of the output `name` (1 in the manifests without "axes")
+    return manifest.get("axes", {}).get(name, 1)
+
+def load_shards(directory):
+    """
+    Read the manifests of the shards (`new-tokens_range_indx_a,b.json`) in `directory` and check that they are consistent
+    (same parameters, original MSA, ancestors and context, same shape of the outputs except for the ancestors axis)
+    and that they don't overlap. Returns the manifests sorted by range, and the missing ranges of ancestors.
+    """
+    shards = []
+    for path in glob.glob(os.path.join(directory, "new-tokens_range_indx_*.json")):
+        with open(path) as f:
+            shards.append(json.load(f))
+    if not shards:
+        raise ValueError(f"No shards found in {directory}")
+    shards.sort(key=lambda m: m["range"][0])
+    ref = shards[0]
+    for shard in shards[1:]:
+        for key in ("params", "original_tokens", "ancestors", "context", "n_ancestors"):
+            if shard[key] != ref[key]:
+                raise ValueError(f"Shard {shard['range']} is not consistent with shard {ref['range']}: different {key}")
+        for name, shape in ref["outputs"].items():
+            other, axis = shard["outputs"].get(name), _axis(ref, name)
+            if other is None or other[:axis] + other[axis + 1:] != shape[:axis] + shape[axis + 1:]:
+                raise ValueError(f"Shard {shard['range']} is not consistent with shard {ref['range']}: different {name} shape")
+    missing, stop = [], 0
+    for shard in shards:
+        start = shard["range"][0]
+        if start < stop:
+            raise ValueError(f"Shard {shard['range']} overlaps with the previous shard (ending at {stop})")
+        if start > stop:
+            missing.append((stop, start))
+        stop = shard["range"][1]
+    if stop < ref["n_ancestors"]:
+        missing.append((stop, ref["n_ancestors"]))
+    return shards, missing
+
+def plan_shards(n_ancestors, n_workers, Iters, context_size, max_cost=None, directory=None):
+    """
+    Split the ancestors `0:n_ancestors` in shards (`range_vals` of `gen_MSAs`) for `n_workers` workers, with the cost of
+    an ancestor estimated as `Iters` x (`context_size` + 1) (number of rows given to the model times the number of
+    iterations). The ancestors are split in `n_workers` shards of (almost) equal cost, or in more shards if the cost of
+    a shard would be larger than `max_cost`. If `directory` contains shards that were already generated only the
+    missing ancestors are split (`n_ancestors` can then be None).
+    Returns a list of tuples `(start, stop, cost)`.
+    """
+    if directory is not None and glob.glob(os.path.join(directory, "new-tokens_range_indx_*.json")):
+        shards, todo = load_shards(directory)
+        n_ancestors = shards[0]["n_ancestors"]
+    else:
+        todo = [(0, n_ancestors)]
+    cost = Iters * (context_size + 1)
+    total = sum(stop - start for start, stop in todo)
+    if total == 0:
+        print("All the shards are already generated")
+        return []
+    n_shards = max(n_workers, -(-total * cost // max_cost) if max_cost else 0)
+    size = -(-total // n_shards)
+    plan = []
+    for start, stop in todo:
+        for s in range(start, stop, size):
+            plan.append((s, min(s + size, stop), (min(s + size, stop) - s) * cost))
+    for start, stop, c in plan:
+        print(f"range_vals {start} {stop}: {stop - start} ancestors, cost {c}")
+    return plan
+
+def merge_shards(directory):
+    """
+    Check the shards in `directory` (see `load_shards`) and concatenate their outputs (along the ancestors axis) in a
+    single memory-mapped `.npy` file for each output (e.g. `new-tokens.npy`, or `shuffled-tokens.npy` with the
+    ancestors of all the shards), with the manifest of the merged result.
+    It raises a ValueError listing the missing ranges if some shards are missing.
+    Returns a dictionary with the (read-only) memory-mapped outputs.
+    """
+    shards, missing = load_shards(directory)
+    if missing:
+        raise ValueError(f"Missing shards (range_vals): {missing}, use `plan_shards` to generate them")
+    merged = {}
+    for name, shape in shards[0]["outputs"].items():
+        axis = _axis(shards[0], name)
+        shape = shape[:axis] + [shards[0]["n_ancestors"]] + shape[axis + 1:]
+        path = os.path.join(directory, name + ".npy")
+        files = [os.path.join(directory, f"{name}_range_indx_{s['range'][0]},{s['range'][1]}.npy") for s in shards]
+        dtype = np.load(files[0], mmap_mode="r").dtype
+        out = np.lib.format.open_memmap(path + ".tmp.npy", mode="w+", dtype=dtype, shape=tuple(shape))
+        for shard, file in zip(shards, files):
+            x = np.load(file, mmap_mode="r")
+            if list(x.shape) != shard["outputs"][name]:
+                raise ValueError(f"The shape of {file} is {x.shape} instead of {shard['outputs'][name]}")
+            out[(slice(None),) * axis + (slice(shard["range"][0], shard["range"][1]),)] = x
+        out.flush()
+        del out
+        os.replace(path + ".tmp.npy", path)
+        merged[name] = np.load(path, mmap_mode="r")
+    manifest = dict(shards[0], range=[0, shards[0]["n_ancestors"]],
+                    outputs={name: list(x.shape) for name, x in merged.items()})
+    with open(os.path.join(directory, "new-tokens.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    print(f"{len(shards)} shards merged in {directory}")
+    return merged
+
+# %% ../04_shards.ipynb 9
+@call_parse
+def plan_MSAs(n_ancestors:Param(help='Number of ancestors (number of sequences of the MSA), not needed with `directory`',type=int,default=None),
+              workers:Param(help='Number of workers',type=int,default=1),
+              Iters:Param(help='Number of iterations of each ancestor',type=int,default=10),
+              num:Param(help='Size of the context MSA',type=int,default=100),
+              max_cost:Param(help='Maximum cost (iterations x context size) of a shard',type=int,default=None),
+              directory:Param(help='Directory of the generated shards, only the missing shards are planned',type=str,default=None)
+              ):
+    "Print the `range_vals` of the shards of a context generation with `gen_MSAs` (only the missing ones if `directory` is given)"
+    plan_shards(n_ancestors, workers, Iters, num, max_cost, directory)
+
+@call_parse
+def merge_MSAs(directory:Param(help='Directory of the generated shards',type=str,default='./')):
+    "Check the shards generated by `gen_MSAs` in `directory` and merge them in a single memory-mapped file"
+    merge_shards(directory)
@@ -0,0 +1,208 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../01_store.ipynb.
+
+# %% auto 0
+__all__ = ['TokenStore', 'HammingIndex']
+
+# %% ../01_store.ipynb 2
+import os
+import string
+import numpy as np
+import torch
+from numba import njit, prange
+from Bio import SeqIO
+
+# Memory-mapped store of the tokens of an MSA
+class TokenStore:
+    """
+    Tokens of one MSA (family) saved on disk as a 2d `.npy` array of int8 (depth x length, the first token of
+    each sequence included) and memory-mapped, so that subsets of rows can be gathered on demand without
+    loading the full MSA in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tokens = np.load(path, mmap_mode="r")
+
+    @property
+    def shape(self):
+        """ Same layout as the tokens of the MSA in `IM_MSA_Transformer.msa_data`: (1, depth, length). """
+        return (1,) + self.tokens.shape
+
+    def __len__(self):
+        return self.tokens.shape[0]
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def gather(self, inds):
+        """
+        Gather the rows `inds` from the disk and return them as a int8 tensor of shape (1, len(`inds`), length).
+        The rows are read in increasing order (to read the file sequentially) and then put back in the order of `inds`.
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        order = np.argsort(inds, kind="stable")
+        rows = np.empty((len(inds), self.tokens.shape[1]), dtype=np.int8)
+        rows[order] = self.tokens[inds[order]]
+        return torch.from_numpy(rows)[None, :, :]
+
+    def sample(self, num):
+        """ Gather `num` rows sampled uniformly at random (without replacement). """
+        return self.gather(torch.randperm(len(self))[:num])
+
+    #-------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def build(cls, filename, path, alphabet):
+        """
+        Tokenize the MSA in the fasta file `filename` with `alphabet` (the alphabet of MSA Transformer) and save it
+        in the store `path`. The records are read one at a time and written directly into the memory-mapped file,
+        insertions (lowercase characters, "." and "*") are removed as in `IM_MSA_Transformer.read_msa`.
+        """
+        translation = str.maketrans(dict.fromkeys(string.ascii_lowercase + ".*"))
+        lut = np.full(256, alphabet.unk_idx, dtype=np.int8)
+        for tok, idx in alphabet.tok_to_idx.items():
+            if len(tok) == 1:
+                lut[ord(tok)] = idx
+        depth, length = 0, None
+        for record in SeqIO.parse(filename, "fasta"):
+            seq_len = len(str(record.seq).translate(translation))
+            if length is not None and seq_len != length:
+                raise RuntimeError("Received unaligned sequences for input to MSA, all sequence lengths must be equal.")
+            depth, length = depth + 1, seq_len
+        if depth == 0:
+            raise ValueError(f"No sequences found in {filename}")
+        tokens = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=np.int8,
+                                           shape=(depth, length + 1))
+        tokens[:, 0] = alphabet.cls_idx
+        for i, record in enumerate(SeqIO.parse(filename, "fasta")):
+            seq = str(record.seq).translate(translation).encode()
+            tokens[i, 1:] = lut[np.frombuffer(seq, dtype=np.uint8)]
+        tokens.flush()
+        del tokens
+        os.replace(path + ".tmp", path)
+        print(f'MSA {filename} tokenized and saved in {path}')
+        return cls(path)
+
+    @classmethod
+    def open(cls, filename, store_dir, alphabet):
+        """
+        Open the store of the MSA in the fasta file `filename` inside the directory `store_dir`, it's built (once)
+        if it doesn't exist or if it is older than `filename`.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        path = os.path.join(store_dir, os.path.splitext(os.path.basename(filename))[0] + ".npy")
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(filename):
+            return cls.build(filename, path, alphabet)
+        return cls(path)
+
+# %% ../01_store.ipynb 10
+@njit
+def _popcount64(x):
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+@njit(parallel=True)
+def _hamming(packed, queries):
+    # Number of positions where the tokens differ: a position differs if any of its bit planes differ
+    n_rows, n_planes, n_words = packed.shape
+    out = np.empty((queries.shape[0], n_rows), dtype=np.int32)
+    for n in prange(n_rows):
+        for q in range(queries.shape[0]):
+            d = np.uint64(0)
+            for w in range(n_words):
+                x = np.uint64(0)
+                for b in range(n_planes):
+                    x |= packed[n, b, w] ^ queries[q, b, w]
+                d += _popcount64(x)
+            out[q, n] = d
+    return out
+
+# Nearest neighbours of the sequences of an MSA in Hamming distance
+class HammingIndex:
+    """
+    Index of the sequences of an MSA (`tokens` of shape (depth, length), the first token of each sequence included)
+    to find quickly the sequences closest (in Hamming distance) to some query sequences. Each token is split in
+    `n_bits` bit planes that are packed in 64-bit words, so that the distances are computed with a few xor/popcount
+    operations per 64 positions. The queries are processed in blocks of `block_size`.
+    """
+    n_bits = 6  # all the tokens of MSA Transformer are smaller than 64
+
+    def __init__(self, tokens=None, packed=None, block_size=256):
+        self.packed = self.pack(tokens) if packed is None else packed
+        self.block_size = block_size
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+    @classmethod
+    def pack(cls, tokens, chunk=8192):
+        """ Bit-packed representation (depth, `n_bits`, words) of the `tokens` (the first token is skipped). """
+        tokens = np.asarray(tokens)
+        n_words = -(-(tokens.shape[1] - 1) // 64)
+        packed = np.zeros((tokens.shape[0], cls.n_bits, n_words * 8), dtype=np.uint8)
+        for start in range(0, tokens.shape[0], chunk):
+            block = np.asarray(tokens[start:start + chunk, 1:], dtype=np.uint8)
+            for b in range(cls.n_bits):
+                bits = np.packbits((block >> b) & 1, axis=1, bitorder="little")
+                packed[start:start + chunk, b, :bits.shape[1]] = bits
+        return packed.view(np.uint64)
+
+    @classmethod
+    def open(cls, store, block_size=256):
+        """ Index of the MSA in the `TokenStore` `store`, saved (once) next to the store and memory-mapped. """
+        path = os.path.splitext(store.path)[0] + ".hamming.npy"
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(store.path):
+            np.save(path + ".tmp.npy", cls.pack(store.tokens))
+            os.replace(path + ".tmp.npy", path)
+        return cls(packed=np.load(path, mmap_mode="r"), block_size=block_size)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def distances(self, queries):
+        """ Hamming distances (number of different positions) between the `queries` (tokens (num queries, length)) and all the sequences. """
+        queries = self.pack(np.asarray(queries).reshape(-1, np.shape(queries)[-1]))
+        return _hamming(np.asarray(self.packed), queries)
+
+    def _masked_distances(self, queries, exclude_identical):
+        d = self.distances(queries)
+        if exclude_identical:
+            d[d == 0] = np.iinfo(np.int32).max
+        return d
+
+    def knn(self, queries, k, exclude_identical=True):
+        """
+        Indices (num queries, `k`) of the `k` sequences closest to each query, sorted by distance.
+        If `exclude_identical` the sequences identical to the query (e.g. the query itself) are not returned.
+        """
+        queries = np.asarray(queries).reshape(-1, np.shape(queries)[-1])
+        k = min(k, len(self))
+        out = np.empty((queries.shape[0], k), dtype=np.int64)
+        for start in range(0, queries.shape[0], self.block_size):
+            d = self._masked_distances(queries[start:start + self.block_size], exclude_identical)
+            if k < len(self):
+                top = np.argpartition(d, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(len(self)), (d.shape[0], 1))
+            order = np.argsort(np.take_along_axis(d, top, axis=1), axis=1, kind="stable")
+            out[start:start + self.block_size] = np.take_along_axis(top, order, axis=1)
+        return out
+
+    def strata(self, query, n_strata=4, exclude_identical=True):
+        """
+        Split the sequences in `n_strata` groups of (almost) equal size by increasing Hamming distance from the
+        sequence `query`, from the most similar to the most distant ones.
+        """
+        d = self._masked_distances(query, exclude_identical)[0]
+        order = np.argsort(d, kind="stable")
+        if exclude_identical:
+            order = order[:np.sum(d != np.iinfo(np.int32).max)]
+        return np.array_split(order, n_strata)
+
+    def sample_strata(self, strata, k, rng=np.random):
+        """ Sample `k` sequences (without replacement) with the same number of sequences from each of the `strata`. """
+        n_strata = len(strata)
+        counts = [k // n_strata + (i < k % n_strata) for i in range(n_strata)]
+        return np.concatenate([rng.choice(stratum, min(c, len(stratum)), replace=False)
+                               for stratum, c in zip(strata, counts)])
+
+    def stratified(self, queries, k, n_strata=4, exclude_identical=True):
+        """ Indices (num queries, `k`) of a similarity-stratified sample of `k` sequences for each query (see `self.strata`). """
+        queries = np.asarray(queries).reshape(-1, np.shape(queries)[-1])
+        return np.stack([self.sample_strata(self.strata(q, n_strata, exclude_identical), k) for q in queries])
@@ -0,0 +1,112 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../03_weights.ipynb.
+
+# %% auto 0
+__all__ = ['WeightStore', 'convert_weights']
+
+# %% ../03_weights.ipynb 3
+import os
+import json
+import shutil
+from argparse import Namespace
+import numpy as np
+import torch
+import esm
+from torch.overrides import TorchFunctionMode
+from fastcore.script import *
+
+class _SkipInit(TorchFunctionMode):
+    # Skip the (random) initialization of the parameters while a model is built: the memory of the parameters is
+    # allocated but never written (so never used) since they are then replaced by the mapped tensors
+    skipped = {"normal_", "uniform_", "fill_", "zero_", "constant_", "zeros_", "ones_",
+               "xavier_uniform_", "xavier_normal_", "kaiming_uniform_", "kaiming_normal_", "trunc_normal_"}
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if getattr(func, "__name__", None) in self.skipped:
+            return args[0] if args else kwargs["tensor"]
+        return func(*args, **kwargs)
+
+# Memory-mapped weights of MSA Transformer
+class WeightStore:
+    """
+    Weights of MSA Transformer saved in the directory `path`: all the tensors are written one after the other
+    (aligned to `align` bytes) in the binary file `weights.bin`, while `weights.json` contains the arguments of the
+    model, its alphabet and the name, dtype, shape and offset of each tensor. The file is memory-mapped in
+    copy-on-write mode: the pages are read from the disk only when they are used and they are shared between
+    processes (until they are modified).
+    """
+    align = 64
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "weights.json")) as f:
+            self.config = json.load(f)
+        self.data = np.memmap(os.path.join(path, "weights.bin"), dtype=np.uint8, mode="c")
+
+    def state_dict(self):
+        """ State dict of the model, made of tensors that share the memory of the mapped file (no copy). """
+        state = {}
+        for name, (dtype, shape, offset) in self.config["tensors"].items():
+            dtype = np.dtype(dtype)
+            size = int(np.prod(shape)) * dtype.itemsize
+            state[name] = torch.from_numpy(self.data[offset:offset + size].view(dtype).reshape(shape))
+        return state
+
+    def build_model(self):
+        """
+        Build MSA Transformer (in eval mode) and its alphabet. The model is first created without initializing its
+        weights and its parameters are then replaced by the mapped tensors (without copying them).
+        """
+        alphabet = esm.Alphabet.from_architecture(self.config["arch"])
+        with _SkipInit():
+            model = esm.MSATransformer(Namespace(**self.config["args"]), alphabet)
+        model.load_state_dict(self.state_dict(), strict=True, assign=True)
+        return model.eval(), alphabet
+
+    #-------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def save(cls, model, path, arch="msa_transformer"):
+        """
+        Save the weights of `model` (an `esm.MSATransformer`) in the directory `path`. The files are written in a
+        temporary directory that is then moved to `path`, so that a store is never read while it's being written.
+        """
+        tmp = path.rstrip("/") + ".tmp"
+        os.makedirs(tmp, exist_ok=True)
+        args = {k: v for k, v in vars(model.args).items() if isinstance(v, (bool, int, float, str, type(None)))}
+        tensors, offset = {}, 0
+        with open(os.path.join(tmp, "weights.bin"), "wb") as f:
+            for name, tensor in model.state_dict().items():
+                array = tensor.detach().cpu().contiguous().numpy()
+                padding = -offset % cls.align
+                f.write(b"\0" * padding)
+                offset += padding
+                f.write(array.tobytes())
+                tensors[name] = (array.dtype.str, list(array.shape), offset)
+                offset += array.nbytes
+        with open(os.path.join(tmp, "weights.json"), "w") as f:
+            json.dump({"arch": arch, "args": args, "tensors": tensors}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        print(f'Weights of the model saved in {path} ({offset/2**20:.1f} MiB)')
+        return cls(path)
+
+    @classmethod
+    def convert(cls, path, pretrained_model_path=None):
+        """
+        Convert the weights of the pretrained ESM checkpoint of MSA Transformer (`esm.pretrained.esm_msa1b_t12_100M_UR50S`)
+        to the directory `path`. If `pretrained_model_path` is given, the fine-tuned state dict saved there (in
+        `["model_state_dict"]`, as used by `IM_MSA_Transformer`) is loaded on top of it before the conversion.
+        """
+        model, _ = esm.pretrained.esm_msa1b_t12_100M_UR50S()
+        if pretrained_model_path is not None:
+            model.load_state_dict(torch.load(pretrained_model_path, map_location="cpu")["model_state_dict"])
+        return cls.save(model.eval(), path)
+
+# %% ../03_weights.ipynb 10
+@call_parse
+def convert_weights(path:Param(help='Directory where the weights are saved',type=str,default='msa_transformer_weights'),
+                    pretrained_model_path:Param(help='Path of a fine-tuned model to load on top of the original one',type=str,default=False)
+                    ):
+    "Convert the weights of MSA Transformer (optionally fine-tuned) into a memory-mappable `WeightStore`"
+    WeightStore.convert(path, pretrained_model_path or None)